@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+"""Compacted archive of every daily pharmacist and pharmacy extract
+
+    Each distinct row is stored once with the first date it appeared
+    and the date it stopped appearing, so a day that changes little
+    adds only a few rows. Any date can be rebuilt from these ranges.
+
+    Usage: archive.py ARCHIVE snapshot pharmacist 2017-03-01
+           archive.py ARCHIVE history pharmacist "Smith, Alex"
+           archive.py ARCHIVE rebuild EXTRACTS_FOLDER
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from changes import normalize, record_hash
+from records import PharmacistData, PharmacyData, read_extract
+
+log = logging.getLogger(__name__)
+
+# Archived record types: name, record type and the column searched by
+# history queries
+ARCHIVES = {
+    "pharmacist": (PharmacistData, "pharmacist"),
+    "pharmacy": (PharmacyData, "pharmacy")
+}
+
+
+class Archive(object):
+    """Delta-encoded history of the daily extracts in a SQLite file
+
+    Rows are kept in a versions table per record type. A version is
+    current from valid_from until valid_to (NULL while it is still in
+    the latest snapshot). Identical rows in one extract are told apart
+    by an occurrence number. Snapshots must be added in date order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "name TEXT, date TEXT, rows INTEGER, PRIMARY KEY (name, date))"
+        )
+
+        for name, (record, key) in ARCHIVES.items():
+            columns = ", ".join(record._fields[1:])
+
+            self.conn.executescript(
+                "CREATE TABLE IF NOT EXISTS {0}_versions ("
+                "hash BLOB, occurrence INTEGER, {1}, "
+                "valid_from TEXT, valid_to TEXT);"
+                "CREATE INDEX IF NOT EXISTS {0}_current "
+                "ON {0}_versions (valid_to, valid_from);"
+                "CREATE INDEX IF NOT EXISTS {0}_key "
+                "ON {0}_versions ({2}, valid_from);".format(
+                    name, columns, key
+                )
+            )
+
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def latest(self, name):
+        """Returns the date of the latest snapshot, or None if empty"""
+        return self.conn.execute(
+            "SELECT MAX(date) FROM snapshots WHERE name = ?", (name,)
+        ).fetchone()[0]
+
+    def add_snapshot(self, name, date, records):
+        """Folds one day's records into the archive
+
+        Rows still present keep their version, new rows start a new
+        version and rows that are gone have their version closed.
+        Returns False (adding nothing) if the date is not after the
+        latest snapshot.
+        """
+        latest = self.latest(name)
+
+        if latest is not None and date <= latest:
+            log.warning(
+                "%s archive already has %s, not adding %s"
+                % (name.capitalize(), latest, date)
+            )
+
+            return False
+
+        record, key = ARCHIVES[name]
+        table = "%s_versions" % name
+        columns = record._fields[1:]
+
+        # Versions in the latest snapshot, by row hash and occurrence
+        current = {}
+
+        for rowid, hashKey, occurrence in self.conn.execute(
+            "SELECT rowid, hash, occurrence FROM %s "
+            "WHERE valid_to IS NULL" % table
+        ):
+            current[(hashKey, occurrence)] = rowid
+
+        seen = {}
+        added = []
+        count = 0
+
+        for r in records:
+            values = r[1:]
+            hashKey = record_hash(normalize(values))
+            occurrence = seen.get(hashKey, 0)
+            seen[hashKey] = occurrence + 1
+            count = count + 1
+
+            if current.pop((hashKey, occurrence), None) is None:
+                added.append((hashKey, occurrence) + tuple(values) + (date,))
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO %s (hash, occurrence, %s, valid_from) "
+                "VALUES (%s)" % (
+                    table, ", ".join(columns),
+                    ", ".join(["?"] * (len(columns) + 3))
+                ),
+                added
+            )
+            self.conn.executemany(
+                "UPDATE %s SET valid_to = ? WHERE rowid = ?" % table,
+                [(date, rowid) for rowid in current.values()]
+            )
+            self.conn.execute(
+                "INSERT INTO snapshots VALUES (?, ?, ?)", (name, date, count)
+            )
+
+        log.info(
+            "Archived %s %s records (%s new versions, %s closed)"
+            % (date, name, len(added), len(current))
+        )
+
+        return True
+
+    def snapshot(self, name, date):
+        """Returns the records as they were in the extract on a date
+
+        Uses the latest snapshot on or before the date. Returns an
+        empty list if the archive starts after the date.
+        """
+        record, key = ARCHIVES[name]
+        snapshotDate = self.conn.execute(
+            "SELECT MAX(date) FROM snapshots WHERE name = ? AND date <= ?",
+            (name, date)
+        ).fetchone()[0]
+
+        if snapshotDate is None:
+            return []
+
+        rows = self.conn.execute(
+            "SELECT %s FROM %s_versions "
+            "WHERE valid_from <= ? AND (valid_to IS NULL OR valid_to > ?) "
+            "ORDER BY rowid" % (", ".join(record._fields[1:]), name),
+            (snapshotDate, snapshotDate)
+        )
+
+        return [record(snapshotDate, *row) for row in rows]
+
+    def history(self, name, value):
+        """Returns every version of the records with the given key
+
+        Each version is returned with the dates it was first and last
+        seen (None for the last date if it is still current).
+        """
+        record, key = ARCHIVES[name]
+        rows = self.conn.execute(
+            "SELECT valid_from, valid_to, %s FROM %s_versions "
+            "WHERE %s = ? ORDER BY valid_from, rowid"
+            % (", ".join(record._fields[1:]), name, key),
+            (value,)
+        )
+
+        return [
+            (validFrom, validTo, record(validFrom, *row))
+            for validFrom, validTo, *row in rows
+        ]
+
+def add_extracts(archive, folder, date):
+    """Folds the pharmacist and pharmacy CSV files for a date"""
+    for name in ARCHIVES:
+        record = ARCHIVES[name][0]
+        path = os.path.join(
+            str(folder), "%s - %s.csv" % (date, name.capitalize())
+        )
+
+        if os.path.exists(path):
+            archive.add_snapshot(
+                name, date,
+                (r for chunk in read_extract(path, record, date)
+                 for r in chunk)
+            )
+        else:
+            log.warning("No extract found at %s" % path)
+
+def rebuild(path, folder):
+    """Creates a new archive from every daily CSV file in the folder"""
+    suffix = " - Pharmacist.csv"
+    dates = sorted(
+        f[:-len(suffix)] for f in os.listdir(str(folder))
+        if f.endswith(suffix)
+    )
+
+    tempPath = "%s.tmp" % path
+
+    if os.path.exists(tempPath):
+        os.remove(tempPath)
+
+    archive = Archive(tempPath)
+
+    for date in dates:
+        add_extracts(archive, folder, date)
+
+    archive.close()
+
+    # Only replace the old archive once the new one is complete
+    os.replace(tempPath, str(path))
+
+    log.info("Rebuilt %s from %s days of extracts" % (path, len(dates)))
+
+def get_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Query the archive")
+    parser.add_argument("archive", help="archive SQLite file")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    snapshotParser = commands.add_parser(
+        "snapshot", help="print the records on a date as CSV"
+    )
+    snapshotParser.add_argument("name", choices=sorted(ARCHIVES))
+    snapshotParser.add_argument("date")
+
+    historyParser = commands.add_parser(
+        "history", help="print every version of a pharmacist or pharmacy"
+    )
+    historyParser.add_argument("name", choices=sorted(ARCHIVES))
+    historyParser.add_argument("value")
+
+    rebuildParser = commands.add_parser(
+        "rebuild", help="rebuild the archive from the daily CSV files"
+    )
+    rebuildParser.add_argument("folder")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    args = get_arguments()
+    start = time.perf_counter()
+
+    if args.command == "rebuild":
+        rebuild(args.archive, args.folder)
+    else:
+        archive = Archive(args.archive)
+        writer = csv.writer(sys.stdout, lineterminator="\n")
+
+        if args.command == "snapshot":
+            records = archive.snapshot(args.name, args.date)
+            writer.writerows(records)
+        else:
+            records = archive.history(args.name, args.value)
+
+            for validFrom, validTo, r in records:
+                writer.writerow((validFrom, validTo or "") + tuple(r[1:]))
+
+        archive.close()
+
+        log.info(
+            "%s records in %.1f ms"
+            % (len(records), (time.perf_counter() - start) * 1000)
+        )
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+"""End to end throughput benchmark against the fake ACP website
+
+    Starts fake_server.py on a local port, runs extract.py against it
+    with no crawl delay in a temporary root folder (uploading to a
+    SQLite stand-in database) and reports pages/sec, records/sec and
+    the peak memory of the extraction.
+
+    Usage: benchmarks/end_to_end.py [--pharmacists 10000] [--parser lxml]
+                                    [--parse-workers 4]
+"""
+
+import argparse
+import configparser
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+PROGRAM = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROGRAM)
+
+import fake_server
+
+
+def write_config(path, settings):
+    """Writes a copy of the program config with the settings changed"""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(PROGRAM, "config.cfg"))
+
+    for key, value in settings.items():
+        config.set("rx_list", key, value)
+
+    with open(path, "w") as file:
+        config.write(file)
+
+def write_logger_config(path, logFolder):
+    """Writes a copy of the logger config that logs to the given folder"""
+    config = configparser.RawConfigParser()
+    config.read(os.path.join(PROGRAM, "logger.cfg"))
+    config.set("handler_fh", "args", "(%r, \"a\")" % logFolder)
+
+    with open(path, "w") as file:
+        config.write(file)
+
+def create_database(path):
+    """Creates the SQLite stand-in for the upload tables"""
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        "CREATE TABLE pharmacist (date TEXT, pharmacist TEXT, "
+        "pharmacy TEXT, address TEXT, city TEXT, postal TEXT, phone TEXT, "
+        "fax TEXT, registration TEXT, apa INTEGER, inject INTEGER, "
+        "restrictions TEXT);"
+        "CREATE TABLE pharmacy (date TEXT, pharmacy TEXT, manager TEXT, "
+        "address TEXT, city TEXT, postal TEXT, phone TEXT, fax TEXT);"
+    )
+    conn.commit()
+    conn.close()
+
+def count_records(folder):
+    """Counts the rows in the extracted CSV files"""
+    total = 0
+
+    for fileName in os.listdir(folder):
+        if fileName.endswith(("Pharmacist.csv", "Pharmacy.csv")):
+            with open(os.path.join(folder, fileName)) as file:
+                total = total + sum(1 for line in file)
+
+    return total
+
+def peak_memory():
+    """Returns the peak memory (MB) of finished child processes"""
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    # Reported in bytes on macOS and kilobytes elsewhere
+    if sys.platform == "darwin":
+        return round(peak / 1024 / 1024, 1)
+
+    return round(peak / 1024, 1)
+
+def run(args):
+    """Runs the benchmark and returns the results"""
+    acp = fake_server.acp_from_arguments(args)
+    server = fake_server.start_server(acp)
+    baseUrl = "http://127.0.0.1:%s" % server.server_address[1]
+
+    temp = tempfile.mkdtemp(prefix="rx_list_bench_")
+    root = os.path.join(temp, "root")
+
+    try:
+        os.makedirs(os.path.join(root, "logs"))
+        os.makedirs(os.path.join(root, "extracts"))
+        os.makedirs(os.path.join(temp, "config"))
+
+        database = os.path.join(temp, "bench.sqlite3")
+        create_database(database)
+
+        with open(os.path.join(temp, "config", "python_config.cfg"),
+                  "w") as file:
+            file.write(
+                "[rx_list]\nengine = sqlite\ndb = %s\n"
+                "table_pharmacist = pharmacist\ntable_pharmacy = pharmacy\n"
+                % database
+            )
+
+        write_config(os.path.join(root, "config.cfg"), {
+            "base_url": baseUrl,
+            "crawl_delay": "0",
+            "adaptive_delay": "False",
+            "parser": args.parser,
+            "parse_workers": str(args.parse_workers),
+            "retry_backoff": "0",
+            "changes": "off"
+        })
+        write_logger_config(
+            os.path.join(root, "logger.cfg"), os.path.join(root, "logs")
+        )
+
+        start = time.perf_counter()
+        subprocess.check_call(
+            [sys.executable, os.path.join(PROGRAM, "extract.py"), root],
+            cwd=PROGRAM
+        )
+        elapsed = time.perf_counter() - start
+
+        records = count_records(os.path.join(root, "extracts"))
+    finally:
+        server.shutdown()
+        shutil.rmtree(temp, ignore_errors=True)
+
+    return {
+        "parser": args.parser,
+        "parse_workers": args.parse_workers,
+        "pharmacists": args.pharmacists,
+        "pharmacies": args.pharmacies,
+        "requests": acp.requests,
+        "errors": acp.errors,
+        "records": records,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(acp.requests / elapsed, 1),
+        "records_per_second": round(records / elapsed, 1),
+        "peak_memory_mb": peak_memory()
+    }
+
+def get_arguments(argv=None):
+    """Adds the benchmark settings to the fake website settings"""
+    parser = argparse.ArgumentParser(
+        description="End to end throughput benchmark",
+        parents=[fake_server.argument_parser(add_help=False)]
+    )
+    parser.add_argument(
+        "--parser", default="bs4", help="parser backend (bs4 or lxml)"
+    )
+    parser.add_argument(
+        "--parse-workers", type=int, default=0,
+        help="processes parsing pages (0 parses in the crawl thread)"
+    )
+    parser.add_argument("--json", help="file to save the results to")
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    results = run(args)
+
+    for key, value in results.items():
+        print("%-20s %s" % (key, value))
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""Checks that the bs4 and lxml parser backends save identical CSVs
+
+    Parses the saved fixture pages in benchmarks/fixtures with each
+    backend, writes the records to a CSV file per backend and compares
+    the bytes. The fixtures are fake ACP website pages plus rows with
+    entities, comments, boolean attributes and odd spacing. Exits with
+    an error at the first difference.
+
+    Usage: benchmarks/parser_parity.py [--parsers bs4,lxml]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+PROGRAM = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROGRAM)
+
+import records
+import sinks
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "fixtures")
+
+# Fixture pages and the record type in each
+PAGES = (
+    ("Pharmacist.html", records.PharmacistData),
+    ("Pharmacy.html", records.PharmacyData)
+)
+
+DATE = "2000-01-01"
+
+
+def ajax_response(tableHtml):
+    """Wraps table HTML in an AJAX response like the website's"""
+    return json.dumps([
+        {"command": "settings", "settings": {}, "merge": True},
+        {"command": "insert", "method": "replaceWith", "data": tableHtml}
+    ])
+
+def write_csv(text, parserName, record, path):
+    """Parses the response with the backend and saves it as a CSV
+
+    Returns the number of records written.
+    """
+    data, lastPage, timings, problems = records.parse_page(
+        text, 0, parserName, record, DATE
+    )
+
+    sink = sinks.CSVSink(path)
+    sink.open()
+    sink.write(data)
+    sink.close()
+
+    return len(data)
+
+def first_difference(first, second):
+    """Returns the number and text of the first line that differs"""
+    for number, lines in enumerate(
+        zip(first.splitlines(), second.splitlines()), 1
+    ):
+        if lines[0] != lines[1]:
+            return number, lines
+
+    return None, (first[-80:], second[-80:])
+
+def check_page(name, record, parserNames, folder):
+    """Raises an AssertionError unless every backend gives the same CSV"""
+    with open(os.path.join(FIXTURES, name), encoding="UTF-8") as file:
+        text = ajax_response(file.read())
+
+    results = []
+
+    for parserName in parserNames:
+        path = os.path.join(folder, "%s - %s.csv" % (parserName, name))
+        count = write_csv(text, parserName, record, path)
+
+        with open(path, "rb") as file:
+            results.append((parserName, count, file.read()))
+
+    expected = results[0]
+    assert expected[1], "%s has no records" % name
+
+    for parserName, count, data in results[1:]:
+        if data != expected[2]:
+            number, lines = first_difference(expected[2], data)
+
+            raise AssertionError(
+                "%s: %s and %s differ at line %s\n  %r\n  %r"
+                % (name, expected[0], parserName, number, lines[0],
+                   lines[1])
+            )
+
+    print("%s: %s records identical with %s"
+          % (name, expected[1], ", ".join(parserNames)))
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Parser backend parity")
+    parser.add_argument(
+        "--parsers", default="bs4,lxml",
+        help="comma separated parser backends to compare"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    folder = tempfile.mkdtemp(prefix="rx_list_parity_")
+
+    try:
+        for name, record in PAGES:
+            check_page(name, record, args.parsers.split(","), folder)
+    finally:
+        for file in os.listdir(folder):
+            os.remove(os.path.join(folder, file))
+
+        os.rmdir(folder)
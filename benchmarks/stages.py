@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmarks for each stage of the extraction
+
+    Generates pharmacist and pharmacy fixtures of each size with the
+    fake ACP website and times the stages on their own: decoding and
+    parsing the AJAX responses, building the records, splitting the
+    addresses, writing the CSV files and uploading to a SQLite
+    database. Results are saved as JSON so two versions can be
+    compared with --compare.
+
+    Usage: benchmarks/stages.py [--sizes 1000,10000] [--json results.json]
+"""
+
+import argparse
+import html
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+PROGRAM = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROGRAM)
+
+import fake_server
+import locations
+import parsers
+import records
+import sinks
+
+# Fixture tables: name, fake website display, record type and the
+# cell and line holding the address
+TABLES = (
+    ("pharmacist", "block_3", records.PharmacistData, 1, 1),
+    ("pharmacy", "block", records.PharmacyData, 2, 0)
+)
+
+DATE = "2000-01-01"
+
+
+def generate_pages(display, size, perPage=50):
+    """Returns the AJAX response text for every page of a fixture"""
+    acp = fake_server.FakeACP(size, size, perPage)
+
+    return [
+        acp.page(display, page) for page in range(-(-size // perPage))
+    ]
+
+def best_time(function, repeat):
+    """Returns the fastest of several timed calls to the function"""
+    times = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+def parse_pages(pages, parser):
+    """Decodes the JSON and parses the table rows of every page"""
+    rows = []
+
+    for text in pages:
+        rows.extend(parser(parsers.get_table_html(text)))
+
+    return rows
+
+def address_lines(rows, cell, line):
+    """Returns the unescaped address line of each row"""
+    lines = []
+
+    for row in rows:
+        lines.append(html.unescape(row.strings(cell)[line].strip()))
+
+    return lines
+
+def write_csv(data, folder):
+    """Writes the records to a CSV file"""
+    sink = sinks.CSVSink(os.path.join(folder, "bench.csv"))
+    sink.open()
+    sink.write(data)
+    sink.close()
+
+def upload(data, fields, folder):
+    """Uploads the records to a fresh SQLite table"""
+    path = os.path.join(folder, "bench.sqlite3")
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE bench (%s)" % ", ".join(fields))
+
+    sink = sinks.DatabaseSink(
+        conn, "bench", fields, DATE, placeholder="?"
+    )
+    sink.open()
+    sink.write(data)
+    sink.close()
+    conn.close()
+
+def run_size(size, parserNames, repeat, folder):
+    """Returns the stage timings for fixtures with the given row count"""
+    results = {}
+
+    for name, display, record, cell, line in TABLES:
+        pages = generate_pages(display, size)
+        timings = {}
+
+        timings["json"] = best_time(
+            lambda: [parsers.get_table_html(text) for text in pages], repeat
+        )
+
+        for parserName in parserNames:
+            parser = parsers.get_parser(parserName)
+            timings["parse_%s" % parserName] = best_time(
+                lambda: parse_pages(pages, parser), repeat
+            )
+
+        rows = parse_pages(pages, parsers.get_parser(parserNames[0]))
+
+        timings["records"] = best_time(
+            lambda: [record.from_row(row, DATE) for row in rows], repeat
+        )
+
+        lines = address_lines(rows, cell, line)
+        timings["split_address"] = best_time(
+            lambda: [locations.split_address(line) for line in lines], repeat
+        )
+
+        data = [record.from_row(row, DATE) for row in rows]
+        timings["csv"] = best_time(lambda: write_csv(data, folder), repeat)
+        timings["upload"] = best_time(
+            lambda: upload(data, record._fields, folder), repeat
+        )
+
+        results[name] = {
+            stage: {
+                "seconds": round(seconds, 6),
+                "rows_per_second": round(size / seconds, 1)
+            }
+            for stage, seconds in timings.items()
+        }
+
+    return results
+
+def get_version():
+    """Returns the git commit being benchmarked, if known"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROGRAM,
+            stderr=subprocess.DEVNULL
+        ).decode("UTF-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, previous):
+    """Prints the change in time for each stage since a previous run"""
+    for size, tables in results["sizes"].items():
+        for table, stages in tables.items():
+            for stage, timing in stages.items():
+                try:
+                    before = previous["sizes"][size][table][stage]["seconds"]
+                except KeyError:
+                    continue
+
+                change = (timing["seconds"] - before) / before * 100
+                print(
+                    "%8s %-11s %-14s %+7.1f%%"
+                    % (size, table, stage, change)
+                )
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Stage micro-benchmarks")
+    parser.add_argument(
+        "--sizes", default="1000,10000,100000",
+        help="comma separated fixture row counts"
+    )
+    parser.add_argument(
+        "--parsers", default="bs4,lxml",
+        help="comma separated parser backends to time"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="file to save the results to")
+    parser.add_argument(
+        "--compare", help="earlier results file to compare against"
+    )
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    parserNames = args.parsers.split(",")
+
+    results = {
+        "version": get_version(),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "sizes": {}
+    }
+
+    with tempfile.TemporaryDirectory(prefix="rx_list_bench_") as folder:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            results["sizes"][str(size)] = run_size(
+                size, parserNames, args.repeat, folder
+            )
+
+            for table, stages in results["sizes"][str(size)].items():
+                for stage, timing in stages.items():
+                    print(
+                        "%8s %-11s %-14s %10.4fs %12.1f rows/s"
+                        % (size, table, stage, timing["seconds"],
+                           timing["rows_per_second"])
+                    )
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=4)
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+import json
+import os
+
+
+class CacheMiss(LookupError):
+    """Raised when a replayed request has no saved response"""
+    pass
+
+class ResponseCache(object):
+    """Compressed copies of the raw AJAX responses for one day
+
+    Responses are saved as gzip files named by a hash of the POST data,
+    in a folder for the date they were requested.
+    """
+
+    def __init__(self, folder, date):
+        self.folder = os.path.join(str(folder), date)
+
+    def path(self, post_data):
+        """Returns the file used for the response to the POST data"""
+        key = json.dumps(post_data, sort_keys=True)
+        name = hashlib.sha1(key.encode("UTF-8")).hexdigest()
+
+        return os.path.join(self.folder, "%s.json.gz" % name)
+
+    def save(self, post_data, text):
+        """Saves a response, replacing any earlier copy"""
+        os.makedirs(self.folder, exist_ok=True)
+
+        path = self.path(post_data)
+        tempPath = path + ".tmp"
+
+        # Write to a temporary file first so a crash never leaves a
+        # partial response in the cache
+        with gzip.open(tempPath, "wt", encoding="UTF-8",
+                       compresslevel=6) as file:
+            file.write(text)
+
+        os.replace(tempPath, path)
+
+    def load(self, post_data):
+        """Returns a saved response, or None if it is not cached"""
+        try:
+            with gzip.open(self.path(post_data), "rt",
+                           encoding="UTF-8") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+class CachedResponse(object):
+    """Response loaded from the cache in place of a requests Response"""
+
+    def __init__(self, text):
+        self.text = text
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.text is None:
+            raise CacheMiss("Response is not in the cache")
+
+class ReplaySession(object):
+    """Stands in for a requests Session by answering from the cache"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def head(self, url, **kwargs):
+        return CachedResponse("")
+
+    def post(self, url, data=None, **kwargs):
+        return CachedResponse(self.cache.load(data))
+
+class RecordingSession(object):
+    """Wraps a requests Session to save every successful AJAX response"""
+
+    def __init__(self, session, cache):
+        self.session = session
+        self.cache = cache
+
+    def head(self, url, **kwargs):
+        return self.session.head(url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        response = self.session.post(url, data=data, **kwargs)
+
+        if response.status_code == 200:
+            self.cache.save(data, response.text)
+
+        return response
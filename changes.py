@@ -0,0 +1,165 @@
+from collections import namedtuple
+import csv
+import hashlib
+import logging
+import os
+
+from sinks import Sink
+
+log = logging.getLogger(__name__)
+
+# Kinds of change between two extracts
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+
+def change_record(record):
+    """Returns the change record type for a record type
+
+    Change records hold the date, the kind of change and then the same
+    fields as the original record, so they can be saved by the same
+    CSV and database sinks.
+    """
+    name = record.__name__.replace("Data", "Change")
+
+    return namedtuple(name, ("date", "change") + record._fields[1:])
+
+def normalize(values):
+    """Returns the values as stripped strings for comparison"""
+    return tuple(str(v).strip() for v in values)
+
+def record_hash(values):
+    """Returns a hash identifying the normalized values"""
+    text = "\x1f".join(values)
+
+    return hashlib.sha1(text.encode("UTF-8")).digest()
+
+def find_previous_extract(folder, name, today):
+    """Returns the path of the latest extract saved before today
+
+    Extracts are named "<date> - <name>.csv", so the dates sort in the
+    same order as the file names. Returns None if there is no earlier
+    extract.
+    """
+    suffix = " - %s.csv" % name
+    previous = None
+
+    for fileName in os.listdir(str(folder)):
+        if not fileName.endswith(suffix):
+            continue
+
+        date = fileName[:-len(suffix)]
+
+        if date < today and (previous is None or date > previous):
+            previous = date
+
+    if previous is None:
+        return None
+
+    return os.path.join(str(folder), previous + suffix)
+
+class ChangeSink(Sink):
+    """Compares records against the previous extract and saves changes
+
+    The previous extract is indexed by a hash of each normalized row.
+    Incoming records that match a hash are unchanged and are dropped,
+    so only the day's churn is held in memory. When the sink closes,
+    rows left over from the previous extract are removals, and an
+    added and removed row sharing the same key (e.g. the pharmacist
+    name) are reported as a single change. The change records are sent
+    to the output sinks.
+    """
+
+    def __init__(self, previousPath, record, keyField, date, sinks):
+        self.previousPath = previousPath
+        self.changeRecord = change_record(record)
+        self.keyIndex = record._fields.index(keyField) - 1
+        self.date = date
+        self.sinks = sinks
+        self.name = "%s changes" % keyField
+        self.previous = {}
+        self.added = []
+
+    def open(self):
+        self.previous = {}
+        self.added = []
+
+        if self.previousPath:
+            with open(self.previousPath, "r") as file:
+                for row in csv.reader(file):
+                    values = normalize(row)
+                    self.previous.setdefault(record_hash(values), []).append(
+                        values
+                    )
+
+            log.info("Comparing against %s" % self.previousPath)
+        else:
+            log.info("No previous extract, every record will be added")
+
+        for sink in self.sinks:
+            sink.open()
+
+    def write(self, records):
+        for r in records:
+            values = normalize(r[1:])
+            hashKey = record_hash(values)
+            matches = self.previous.get(hashKey)
+
+            if matches:
+                matches.pop()
+
+                if not matches:
+                    del self.previous[hashKey]
+            else:
+                self.added.append(values)
+
+    def close(self):
+        removed = [v for rows in self.previous.values() for v in rows]
+
+        # Rows whose key appears once on each side are a single change
+        addedKeys = {}
+        removedKeys = {}
+
+        for values in self.added:
+            key = values[self.keyIndex]
+            addedKeys[key] = addedKeys.get(key, 0) + 1
+
+        for values in removed:
+            key = values[self.keyIndex]
+            removedKeys[key] = removedKeys.get(key, 0) + 1
+
+        changes = []
+        counts = {ADDED: 0, REMOVED: 0, CHANGED: 0}
+
+        for values in self.added:
+            key = values[self.keyIndex]
+
+            if addedKeys[key] == 1 and removedKeys.get(key) == 1:
+                change = CHANGED
+            else:
+                change = ADDED
+
+            counts[change] = counts[change] + 1
+            changes.append(self.changeRecord(self.date, change, *values))
+
+        for values in removed:
+            key = values[self.keyIndex]
+
+            if addedKeys.get(key) == 1 and removedKeys[key] == 1:
+                continue
+
+            counts[REMOVED] = counts[REMOVED] + 1
+            changes.append(self.changeRecord(self.date, REMOVED, *values))
+
+        for sink in self.sinks:
+            sink.write(changes)
+            sink.close()
+
+        log.info(
+            "%s added, %s removed, %s changed since the previous extract"
+            % (counts[ADDED], counts[REMOVED], counts[CHANGED])
+        )
+
+        self.previous = {}
+        self.added = []
@@ -0,0 +1,215 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Checkpoint(object):
+    """Durable record of the pages already extracted during a run
+
+    Each completed page is saved to a SQLite file along with its parsed
+    records, in a single transaction, so an interrupted run on the same
+    day can replay what it already has and resume at the next page
+    instead of requesting everything again. The last page listed by 
+    the pager is saved too, so a resumed crawl does not need to find 
+    the end again.
+
+    Crawls run in time-budgeted windows are marked as fetched once 
+    every page is saved, and each window is recorded, so the pages can
+    be merged into the day's extract after the last window.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        # Pages are saved from the worker thread
+        self.conn = sqlite3.connect(str(path), check_same_thread=False)
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "crawl TEXT, page INTEGER, count INTEGER, "
+            "PRIMARY KEY (crawl, page));"
+            "CREATE TABLE IF NOT EXISTS records ("
+            "crawl TEXT, page INTEGER, data TEXT);"
+            "CREATE TABLE IF NOT EXISTS crawls ("
+            "crawl TEXT PRIMARY KEY, complete INTEGER);"
+            "CREATE TABLE IF NOT EXISTS pagers ("
+            "crawl TEXT PRIMARY KEY, lastPage INTEGER);"
+            "CREATE TABLE IF NOT EXISTS fetched (crawl TEXT PRIMARY KEY);"
+            "CREATE TABLE IF NOT EXISTS windows ("
+            "started TEXT, seconds REAL, pages INTEGER);"
+        )
+        self.conn.commit()
+
+    def save_page(self, crawl, page, records):
+        """Saves the records from a completed page"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                (crawl, page, len(records))
+            )
+            self.conn.execute(
+                "DELETE FROM records WHERE crawl = ? AND page = ?",
+                (crawl, page)
+            )
+            self.conn.executemany(
+                "INSERT INTO records VALUES (?, ?, ?)",
+                [(crawl, page, json.dumps(r)) for r in records]
+            )
+
+    def resume_point(self, crawl, start):
+        """Returns the next page, trailing blank pages and missing pages
+
+        Missing pages are those between the start and the last saved 
+        page that never completed (e.g. failed requests). Returns None 
+        if no pages have been saved for the crawl.
+        """
+        with self.lock:
+            pages = self.conn.execute(
+                "SELECT page, count FROM pages WHERE crawl = ? ORDER BY page",
+                (crawl,)
+            ).fetchall()
+
+        if not pages:
+            return None
+
+        stop = 0
+
+        for page, count in reversed(pages):
+            if count:
+                break
+
+            stop = stop + 1
+
+        nextPage = pages[-1][0] + 1
+        saved = set(page for page, count in pages)
+        missing = [p for p in range(start, nextPage) if p not in saved]
+
+        return nextPage, stop, missing
+
+    def save_last_page(self, crawl, lastPage):
+        """Saves the last page index listed by the pager"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pagers VALUES (?, ?)",
+                (crawl, lastPage)
+            )
+
+    def last_page(self, crawl):
+        """Returns the saved last page index, or None if not found yet"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT lastPage FROM pagers WHERE crawl = ?", (crawl,)
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def replay(self, crawl, record):
+        """Yields the saved records one page at a time"""
+        with self.lock:
+            pages = self.conn.execute(
+                "SELECT page FROM pages WHERE crawl = ? ORDER BY page",
+                (crawl,)
+            ).fetchall()
+
+        for page, in pages:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT data FROM records "
+                    "WHERE crawl = ? AND page = ? ORDER BY rowid",
+                    (crawl, page)
+                ).fetchall()
+
+            yield [record(*json.loads(data)) for data, in rows]
+
+    def is_complete(self, crawl):
+        """Returns True if the crawl has already finished"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT complete FROM crawls WHERE crawl = ?", (crawl,)
+            ).fetchone()
+
+        return bool(row and row[0])
+
+    def mark_complete(self, crawl):
+        """Records that the crawl finished and its output was saved"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO crawls VALUES (?, 1)", (crawl,)
+            )
+
+    def is_fetched(self, crawl):
+        """Returns True if every page of a windowed crawl is saved"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM fetched WHERE crawl = ?", (crawl,)
+            ).fetchone()
+
+        return row is not None
+
+    def mark_fetched(self, crawl):
+        """Records that a windowed crawl has saved every page"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO fetched VALUES (?)", (crawl,)
+            )
+
+    def page_count(self):
+        """Returns the number of pages saved for every crawl"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM pages"
+            ).fetchone()[0]
+
+    def page_ranges(self, crawl):
+        """Returns the saved pages as a list of [first, last] ranges"""
+        with self.lock:
+            pages = self.conn.execute(
+                "SELECT page FROM pages WHERE crawl = ? ORDER BY page",
+                (crawl,)
+            ).fetchall()
+
+        ranges = []
+
+        for page, in pages:
+            if ranges and ranges[-1][1] == page - 1:
+                ranges[-1][1] = page
+            else:
+                ranges.append([page, page])
+
+        return ranges
+
+    def add_window(self, started, seconds, pages):
+        """Records a crawl window and the pages it saved"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO windows VALUES (?, ?, ?)",
+                (started, seconds, pages)
+            )
+
+    def windows(self):
+        """Returns every crawl window recorded, oldest first"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT started, seconds, pages FROM windows ORDER BY rowid"
+            ).fetchall()
+
+        return [
+            {"started": started, "seconds": seconds, "pages": pages}
+            for started, seconds, pages in rows
+        ]
+
+    def remove(self):
+        """Deletes the checkpoint once the whole run has finished"""
+        self.conn.close()
+
+        if self.path == ":memory:":
+            return
+
+        try:
+            os.remove(str(self.path))
+        except OSError:
+            log.exception("Unable to remove checkpoint %s" % self.path)
@@ -0,0 +1,127 @@
+import gzip
+import logging
+import os
+import sqlite3
+
+from sinks import Sink, CSVSink, DatabaseSink, INDEXED_FIELDS
+
+log = logging.getLogger(__name__)
+
+
+class GzipCSVSink(CSVSink):
+    """Writes the same quoted CSV as CSVSink, compressed with gzip
+
+    Pages are not flushed one at a time, as each flush would end a
+    compressed block early and make the file larger.
+    """
+
+    def open(self):
+        self.file = gzip.open(str(self.path), "wt", newline="")
+        self.writer = self.create_writer(self.file)
+
+    def write(self, records):
+        self.writer.writerows(r[1:] for r in records)
+
+class ParquetSink(Sink):
+    """Saves records to a Parquet file with pyarrow
+
+    Unlike the CSV files the date is kept as the first column, so
+    daily files can be read together as one dataset. Values are
+    collected column by column and written when the sink closes.
+    pyarrow is only needed when this export is used.
+    """
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.name = path
+        self.fields = fields
+        self.columns = None
+
+    def open(self):
+        # Fails here, before any pages arrive, if pyarrow is missing
+        import pyarrow
+
+        self.columns = [[] for field in self.fields]
+
+    def write(self, records):
+        for column, values in zip(self.columns, zip(*records)):
+            column.extend(values)
+
+    def close(self):
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.table(dict(zip(self.fields, self.columns)))
+        pyarrow.parquet.write_table(table, str(self.path))
+
+        self.columns = None
+
+        log.info("Data written to %s" % self.path)
+
+class SQLiteSink(DatabaseSink):
+    """Saves records to a table in a local SQLite file
+
+    The table is created with indexes on the date and the name, city
+    and postal code columns, so one file can hold every day's extract
+    and still be searched quickly. Rows already saved for the date are
+    replaced.
+    """
+
+    def __init__(self, path, table, fields, date, chunkSize=1000):
+        super(SQLiteSink, self).__init__(
+            None, table, fields, date, chunkSize, "?"
+        )
+        self.path = path
+        self.name = "%s (%s)" % (table, path)
+
+    def open(self):
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS %s (%s)"
+            % (self.table, ", ".join(self.columns))
+        )
+
+        for field in ("date",) + INDEXED_FIELDS:
+            if field in self.columns:
+                self.conn.execute(
+                    "CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s)"
+                    % (self.table, field, self.table, field)
+                )
+
+        self.conn.commit()
+
+        super(SQLiteSink, self).open()
+
+    def close(self):
+        super(SQLiteSink, self).close()
+
+        self.conn.close()
+
+def create_exporters(names, folder, date, name, record):
+    """Returns the export sinks for one set of records
+
+    Names are the export formats to create: csv.gz, parquet or sqlite.
+    Daily files are named like the CSV extracts, while the SQLite
+    export is a single file with a table per record type.
+    """
+    sinks = []
+
+    for export in names:
+        if export == "csv.gz":
+            sinks.append(GzipCSVSink(
+                os.path.join(str(folder), "%s - %s.csv.gz" % (date, name))
+            ))
+        elif export == "parquet":
+            sinks.append(ParquetSink(
+                os.path.join(str(folder), "%s - %s.parquet" % (date, name)),
+                record._fields
+            ))
+        elif export == "sqlite":
+            sinks.append(SQLiteSink(
+                os.path.join(str(folder), "Extracts.sqlite3"), name.lower(),
+                record._fields, date
+            ))
+        else:
+            log.warning("Unknown export format: %s" % export)
+
+    return sinks
@@ -52,192 +52,43 @@
 """
 
 import sys
+import argparse
 from unipath import Path
 import configparser
 import logging.config
-from urllib import robotparser
 import os
 import datetime
-from requests import Session
 import json
-from bs4 import BeautifulSoup
-import html
-import re
 import time
-import csv
-import pymysql
+import sqlite3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from scheduler import (
+    RequestScheduler, AdaptiveScheduler, RetryQueue, parse_retry_after
+)
+from robots import read_robots, get_robots_delay, robots_cache_path
+from parsers import get_parser
+from records import PharmacistData, PharmacyData, parse_page, read_extract
+from sinks import (
+    CSVSink, DatabaseSink, LoadDataSink, Pipeline, StagingTables
+)
+from checkpoint import Checkpoint
+from changes import ChangeSink, change_record, find_previous_extract
+from cache import ResponseCache, ReplaySession, RecordingSession
+from metrics import RunMetrics
+from handlers import start_queue_logging
+from exporters import create_exporters
+from archive import Archive, add_extracts
+from search import build_indexes
+from links import PharmacyLink, link_pharmacies
+from validate import ValidationSink
+
+# Website to extract from (only changed to test against a local server)
+BASE_URL = "https://pharmacists.ab.ca"
+
+log = logging.getLogger(__name__)
 
 
-class PharmacistData(object):
-    """Takes a row of pharmacist table data and converts to object"""
-
-    def __init__(self, row):
-        # Data is contained within the table cells
-        cells = row.find_all("td")
-
-        # Pharmacist Name
-        pharmacist = cells[0].renderContents().strip().decode("UTF-8")
-
-        # Convert pharmacy cell into individual lines
-        location = []
-
-        for line in cells[1].strings:
-            location.append(line.strip())
-
-        # Extract Pharmacy
-        pharmacy = ""
-
-        try:
-            pharmacy = html.unescape(location[0])
-        except Exception:
-            msg = "Exception identifying pharmacy for %s" % pharmacist
-            log.exception(msg)
-    
-        # Extract Address, City, Postal Code, Phone and Fax
-        address = ""
-        city = ""
-        postal = ""
-        phone = ""
-        fax = ""
-
-        if pharmacy:
-            try:
-                tempAddress = html.unescape(location[1].strip())
-            
-                try:
-                    # Postal Code is the last content after the final comma
-                    comma_pos = tempAddress.rfind(",")
-                    postal = tempAddress[comma_pos + 2:]
-                    tempAddress = tempAddress[0:comma_pos].strip()
-
-                    # City is now the last content after the final comma
-                    comma_pos = tempAddress.rfind(",")
-                    city = tempAddress[comma_pos + 2:]
-
-                    # Address is the remaining information
-                    address = tempAddress[0:comma_pos]
-                except:
-                    # Failed to split properly, dump contents into address
-                    address = tempAddress
-
-                    # Log issue
-                    log.warn("Unable to parse address for %s" % pharmacist)
-            except Exception:
-                log.exception("Unable to find address for %s" % pharmacist)
-        
-            try:
-                phone = re.sub(r"\D", "", location[3])
-            except Exception:
-                log.exception("Unable to identify phone for %s" % pharmacist)
-
-            try:
-                fax = re.sub(r"\D", "", location[4])
-            except Exception:
-                log.exception("Unable to identify fax for %s" % pharmacist)
-
-        # Registration Status
-        registration = cells[2].renderContents().strip().decode("UTF-8")
-
-        # Authorizations
-        authorizations = cells[3].renderContents().strip().decode("UTF-8")
-    
-        if "Addtl Prescribing Authorization" in authorizations:
-            apa = 1
-        else:
-            apa = 0
-
-        if "Administer Drugs by Injection" in authorizations:
-            inject = 1
-        else:
-            inject = 0
-
-        # Restrictions
-        restrictions = cells[4].renderContents().strip().decode("UTF-8")
-
-        self.date = today
-        self.pharmacist = pharmacist
-        self.pharmacy = pharmacy
-        self.address = address
-        self.city = city
-        self.postal = postal
-        self.phone = phone
-        self.fax = fax
-        self.registration = registration
-        self.apa = apa
-        self.inject = inject
-        self.restrictions = restrictions
-
-class PharmacyData(object):
-    pharmacy = ""
-    manager = ""
-    address = ""
-    city = ""
-    postal = ""
-    phone = ""
-    fax = ""
-
-    def __init__(self, row):
-        """Extracts pharmacy details from the table row"""
-        # Data is contained within the table cells
-        cells = row.find_all("td")
-
-        # Pharmacy Name
-        pharmacy = cells[0].renderContents().strip().decode("UTF-8")
-        pharmacy = html.unescape(pharmacy)
-
-        # Manager
-        manager = cells[1].renderContents().strip().decode("UTF-8")
-
-        # Location, Phone, Fax are all in one cell
-        location_contact = []
-
-        # Convert cell into individual lines
-        for line in cells[2].strings:
-            location_contact.append(line.strip())
-
-        # Attempt to split details out of first line
-        try:
-            tempAddress = html.unescape(location_contact[0].strip())
-
-            # Postal Code is the last content after the final comma
-            comma_pos = tempAddress.rfind(",")
-            postal = tempAddress[comma_pos + 2:]
-            tempAddress = tempAddress[0:comma_pos].strip()
-
-            # City is now the last content after the final comma
-            comma_pos = tempAddress.rfind(",")
-            city = tempAddress[comma_pos + 2:]
-
-            # City is the remaining information
-            address = tempAddress[0:comma_pos]
-        except Exception:
-            # Failed to split properly, dump contents into address
-            address = location_contact[0].strip()
-        
-            # Log issue
-            log.exception("Unable to parse address for %s" % pharmacy)
-
-        # Phone is typically the sixth entry
-        try:
-            phone = location_contact[5].strip()
-        except Exception:
-            log.exception("Unable to parse phone for %s" % pharmacy)
-
-        # Fax is typically ninth entry
-        try:
-            fax = location_contact[8].strip()
-        except Exception:
-            log.exception("Unable to parse fax for %s" % pharmacy)
-
-        self.date = today
-        self.pharmacy = pharmacy
-        self.manager = manager
-        self.address = address
-        self.city = city
-        self.postal = postal
-        self.phone = phone
-        self.fax = fax
-
 def get_today():
     """Returns todays date"""
     today = datetime.date.today()
@@ -248,7 +99,7 @@ def get_today():
 
     return date
 
-def set_log_properties(conf):
+def set_log_properties(root, conf):
     """Sets up logging settings and returns logger"""
     logDebug = True if conf.get("rx_list", "log_debug") == "True" else False
     
@@ -257,14 +108,25 @@ def set_log_properties(conf):
     else:
         configPath = root.child("logger.cfg")
     
-    logging.config.fileConfig(configPath)
+    # Keep loggers from the helper modules that are already imported
+    logging.config.fileConfig(configPath, disable_existing_loggers=False)
+
+    # Log files are written on a background thread
+    start_queue_logging()
 
     log = logging.getLogger(__name__)
     
     return log
 
-def get_permission(agent):
-    """Checks the specified robot.txt file for access permission."""
+def get_permission(agent, baseUrl, cacheFolder, ttl, delay=None):
+    """Checks the specified robot.txt file for access permission.
+
+    robots.txt is saved in cacheFolder under the site's address and 
+    reused for ttl seconds. The crawl delay is the one asked for in 
+    robots.txt (Crawl-delay or Request-rate); a delay from the config 
+    can only make it slower. If neither is given the delay is 10 
+    seconds.
+    """
     class Crawl:
         """Class to contain robot parser output"""
         can = False
@@ -274,21 +136,28 @@ def get_permission(agent):
             self.can = can
             self.delay = delay
     
-    txtUrl = "https://pharmacists.ab.ca/robots.txt"
-    reqUrl = "https://pharmacists.ab.ca/views/"
+    txtUrl = "%s/robots.txt" % baseUrl
+    reqUrl = "%s/views/" % baseUrl
 
-    robot = robotparser.RobotFileParser()
-    robot.set_url(txtUrl)
-    robot.read()
+    robot = read_robots(
+        txtUrl, agent, robots_cache_path(cacheFolder, txtUrl), ttl
+    )
 
     can_crawl = robot.can_fetch(agent, reqUrl)
-    crawl_delay = 10
+    robotsDelay = get_robots_delay(robot, agent)
+
+    if robotsDelay is None:
+        crawl_delay = 10 if delay is None else delay
+    else:
+        crawl_delay = max(robotsDelay, delay or 0)
 
     return Crawl(can_crawl, crawl_delay)
 
-def generate_session(user):
+def generate_session(user, baseUrl):
     """Create session with pharmacists.ab.ca"""
-    url = "https://pharmacists.ab.ca"
+    from requests import Session
+
+    url = baseUrl
 
     try:
         session = Session()
@@ -299,342 +168,1269 @@ def generate_session(user):
         
     return session
 
-def acp_ajax_request(session, post_data):
+def acp_ajax_request(session, post_data, baseUrl):
     """Creates AJAX request with ACP website to return requested data"""
     response = session.post(
-        url = "https://pharmacists.ab.ca/views/ajax",
+        url = "%s/views/ajax" % baseUrl,
         data = post_data,
         headers = {
-            'Referer': 'https://pharmacists.ab.ca'
+            'Referer': baseUrl
         }
     )
+
+    # Error responses (e.g. 429 or 503) are raised to be retried
+    response.raise_for_status()
     
-    # Returns the data in JSON format
-    json_response = json.loads(response.text)
-    json_response = json_response[1]['data']
-    #json_response = json_response.encode('utf8')
-    
-    # Extracts out just the table rows containing data
-    soup = BeautifulSoup(json_response, 'lxml')
-    rows = soup.select("table.table-striped tbody tr")
-    
-    return rows
+    return response.text
+
+def get_retry_after(error):
+    """Returns the Retry-After seconds from a failed request, if any"""
+    response = getattr(error, "response", None)
+
+    if response is None:
+        return None
+
+    return parse_retry_after(response.headers.get("Retry-After"))
+
+class PageParser(object):
+    """Parses AJAX responses on the writer thread or in worker processes
+
+    Without workers, a page is parsed and written on the writer thread
+    while the next one is requested, so two pages are kept in flight.
+    With workers, responses are sent to a process pool as they arrive
+    so parsing runs across several cores, and up to two pages per 
+    worker are kept in flight. The records are still written in the 
+    order the pages were requested.
+    """
+
+    def __init__(self, name, date, workers=0):
+        # Checks the backend name before any work is sent to it
+        get_parser(name)
+
+        self.name = name
+        self.date = date
+        self.pool = ProcessPoolExecutor(workers) if workers else None
+        self.depth = workers * 2 if workers else 2
+
+    def submit(self, text, page, record):
+        """Starts parsing a page if possible
+
+        Returns a function that gives the records and last page index.
+        """
+        if self.pool:
+            return self.pool.submit(
+                parse_page, text, page, self.name, record, self.date
+            ).result
+
+        return lambda: parse_page(text, page, self.name, record, self.date)
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+
+class DataRequest(object):
+    """Details for requesting one set of data from the ACP website"""
+
+    def __init__(self, name, displayId, pager, record, start, stopNum, 
+                 baseUrl=BASE_URL):
+        self.name = name
+        self.displayId = displayId
+        self.pager = pager
+        self.record = record
+        self.start = start
+        self.stopNum = stopNum
+        self.baseUrl = baseUrl
+
+    def post_data(self, page):
+        """Create POST data for retrieving the requested page"""
+        return {
+            "view_name": "_acp_advance_filter",
+            "view_display_id": self.displayId,
+            "page": (self.pager % page)
+        }
+
+def process_page(parse, i, request, pipeline, checkpoint, metrics):
+    """Collects a parsed page and sends its records to the sinks
+
+    Returns the number of records found on the page and the last page
+    index listed in the response (None if it was not found). Returns 
+    None if the response could not be read so the page can be retried.
+    """
+    try:
+        data, lastPage, timings, problems = parse()
+    except Exception:
+        log.exception("Error parsing response for page %s" % i)
+
+        return None
 
-def request_pharmacist_data(ses, conf, crawlDelay):
-    """Requests pharmacist data from the ACP website"""
-    data = []
+    # One warning for each kind of problem instead of one per row
+    problems.log(request.name, i)
 
-    log.info("STARTING PHARMACIST DATA EXTRACTION")
+    metrics.add_page(request.name, i, len(data), **timings)
 
-    i = int(conf.get("rx_list", "pharmacist_start"))
-    stopNum = int(conf.get("rx_list", "request_end"))
+    # Stream the page on to the sinks so only one page is held in memory
+    pipeline.write(data)
+
+    # Page is complete once its records have been checkpointed
+    checkpoint.save_page(request.name, i, data)
+
+    return len(data), lastPage
+
+def request_data(ses, scheduler, pool, parser, request, pipeline, 
+                 checkpoint, retries, metrics):
+    """Requests every page of data listed by the website pager
+
+    The last page is read from the pager in the first response so an
+    exact list of pages is requested. If the pager cannot be found, 
+    pages are requested until stopNum blank pages are returned (or 
+    stopNum requests in a row fail).
+
+    The last page is saved in the checkpoint, so a resumed crawl (or 
+    the next crawl window) requests no pages past it.
+
+    Requests are paced by the shared scheduler, while each response is
+    parsed and written on the worker pool so this overlaps the crawl 
+    delay. Only one page is in flight until the pager has been read, 
+    then up to the parser depth. Failed pages are put in the retry 
+    queue and requested again once their backoff has passed. Any pages
+    saved in the checkpoint are replayed to the sinks and the requests
+    resume after them. Returns the total number of records found.
+
+    Yields before each request (None, as the request waits on the 
+    scheduler) and before waiting for a retry (the monotonic time the 
+    retry is due), so crawls can be interleaved and stopped between 
+    requests without sleeping past a deadline (see crawl_window). If 
+    stopped, pages already requested are still saved.
+    """
+    log.info("STARTING %s DATA EXTRACTION" % request.name.upper())
+
+    total = 0
+    i = request.start
     stop = 0
+    failures = 0
+    lastPage = None
+    pending = deque()
+    depth = 1
+    drain = False
 
-    # Loop until 5 blank requests (signalling data end or repeated errors)
-    while stop < 1:
-	    # Pause request to comply with robots.txt crawl-delay
-        time.sleep(crawlDelay)
+    # Resume from an earlier run today
+    resume = checkpoint.resume_point(request.name, request.start)
 
-        # Create POST data for retrieving pharmacist information
-        post_data = {
-	        "view_name": "_acp_advance_filter",
-	        "view_display_id": "block_3",
-	        "page": ("0,0,0,0,0,0,%s" % i)
-        }
+    if resume:
+        i, stop, missing = resume
+
+        for page_data in checkpoint.replay(request.name, request.record):
+            pipeline.write(page_data)
+            total = total + len(page_data)
+
+        # Pages that failed in the earlier run are requested again
+        for page in missing:
+            retries.push(page)
+
+        log.info("Resuming at page %s with %s saved records" % (i, total))
+
+    # Last page found by an earlier run or crawl window
+    lastPage = checkpoint.last_page(request.name)
+
+    if lastPage is not None:
+        report_finish(request, i, lastPage, scheduler.delay)
+
+    # Loop until the last page (or stopNum blank requests if unknown)
+    while True:
+        # Collect pages in order until there is room for another request
+        while pending and (drain or len(pending) >= depth):
+            pendingPage, future = pending.popleft()
+            result = future.result()
+
+            if result is None:
+                failures = failures + 1
+                retries.add(pendingPage)
+            else:
+                count, pageLast = result
+                failures = 0
+
+                # Checks if there is data in page; if not, increment stop
+                if not count:
+                    stop = stop + 1
+
+                total = total + count
+
+                if lastPage is None and pageLast is not None:
+                    lastPage = pageLast
+                    checkpoint.save_last_page(request.name, lastPage)
+                    report_finish(request, i, lastPage, scheduler.delay)
+
+        drain = False
+        depth = parser.depth if lastPage is not None else 1
+
+        # Checks if there are pages left in the initial pass
+        if lastPage is not None:
+            more = i <= lastPage
+        else:
+            more = stop < request.stopNum and failures < request.stopNum
+
+        # Failed pages are retried as soon as their backoff has passed
+        page = retries.due()
+
+        if page is None:
+            if more:
+                page = i
+                i = i + 1
+            elif pending:
+                # Results still to come may need retries
+                drain = True
+                continue
+            elif retries:
+                yield retries.ready_at()
+
+                retries.wait()
+                continue
+            else:
+                break
 
-	    # Processes AJAX response and retrieve response
         try:
-            log.debug("Requesting page %s" % i)
+            yield None
+        except GeneratorExit:
+            for pendingPage, future in pending:
+                future.result()
 
-            page_data = acp_ajax_request(ses, post_data)
-        except Exception:
-            log.exception("Error with request for page %s" % i)
-            page_data = []
-        
-        # Checks if there is data in request; if not, increment stop counter
-        if not page_data:
-            stop = stop + 1
-
-        # Process AJAX request into a python list
-        for row in page_data:
-            try:
-                data.append(PharmacistData(row))
-            except Exception:
-                log.exception("Error processing page %s request" % i)
-
-        i = i + 1
-    
-    log.info("PHARMACIST DATA EXTRACTION COMPLETE")
+            raise
 
-    return data
+        # Pause request to comply with robots.txt crawl-delay
+        slept = scheduler.wait()
 
-def request_pharmacy_data(ses, conf, crawlDelay):
-    data = []
-    
-    log.info("STARTING PHARMACY DATA EXTRACTION")
+        # Processes AJAX response and retrieve response
+        start = time.perf_counter()
 
-    i = int(conf.get("rx_list", "pharmacy_start"))
-    stopNum = int(conf.get("rx_list", "request_end"))
-    stop = 0
+        try:
+            log.debug("Requesting page %s" % page)
+
+            text = acp_ajax_request(
+                ses, request.post_data(page), request.baseUrl
+            )
+        except Exception as e:
+            latency = time.perf_counter() - start
+            scheduler.record(latency, True)
+            metrics.add_page(
+                request.name, page, sleep=slept, network=latency
+            )
+            log.exception("Error with request for page %s" % page)
 
-    # Loop until 5 blank requests (signalling data end or repeated errors)
-    while stop < stopNum:
-	    # Pause request to comply with robots.txt crawl-delay
-        time.sleep(crawlDelay)
+            # Server asked for all requests to slow down
+            retryAfter = get_retry_after(e)
 
-        # Create POST data for retrieving pharmacy information
-        post_data = {
-	        "view_name": "_acp_advance_filter",
-	        "view_display_id": "block",
-	        "page": ("0,%s" % i)
-        }
+            if retryAfter:
+                scheduler.pause(retryAfter)
+
+            failures = failures + 1
+            retries.add(page, retryAfter)
+
+            continue
+
+        latency = time.perf_counter() - start
+        scheduler.record(latency)
+        metrics.add_page(
+            request.name, page, sleep=slept, network=latency
+        )
+
+        parse = parser.submit(text, page, request.record)
+        pending.append((page, pool.submit(
+            process_page, parse, page, request, pipeline, checkpoint, 
+            metrics
+        )))
+
+    if retries.failed:
+        log.error(
+            "Unable to retrieve %s pages: %s" 
+            % (request.name, ", ".join(str(p) for p in retries.failed))
+        )
+
+    log.info(
+        "%s DATA EXTRACTION COMPLETE (%s records)" 
+        % (request.name.upper(), total)
+    )
+
+    return total
+
+def crawl_window(ses, scheduler, pool, parser, requests, checkpoint, 
+                 retryAttempts, retryBackoff, metrics, budget):
+    """Requests pages from each crawl in turn until the budget runs out
+
+    The crawl whose next request can start soonest goes next (taking 
+    turns when they are equal), and pages are only saved to the 
+    checkpoint, where the next window continues from. No request or 
+    retry is started if the crawl delay, a Retry-After pause or a retry
+    backoff would push it past the budget (in seconds). A crawl that 
+    gets every page without failures is marked as fetched. Returns True
+    once every crawl has been fetched.
+    """
+    started = datetime.datetime.now()
+    deadline = time.monotonic() + budget
+    savedPages = checkpoint.page_count()
+    crawls = deque()
+
+    for request in requests:
+        if checkpoint.is_fetched(request.name):
+            continue
+
+        retries = RetryQueue(retryAttempts, retryBackoff)
+        crawls.append((request, retries, request_data(
+            ses, scheduler, pool, parser, request, Pipeline([]), 
+            checkpoint, retries, metrics
+        ), None))
+
+    while crawls:
+        # A crawl waiting for a retry is due then, the others at the
+        # next request slot (which includes any Retry-After pause)
+        starts = [
+            scheduler.next_start() if readyAt is None else readyAt
+            for request, retries, pages, readyAt in crawls
+        ]
+        position = starts.index(min(starts))
+
+        if starts[position] >= deadline:
+            break
+
+        request, retries, pages, readyAt = crawls[position]
+        del crawls[position]
 
-	    # Processes AJAX response and retrieve response
         try:
-            log.debug("Requesting page %s" % i)
+            readyAt = next(pages)
+        except StopIteration:
+            if retries.failed:
+                log.warning(
+                    "%s pages will be requested again in the next window"
+                    % request.name.capitalize()
+                )
+            else:
+                checkpoint.mark_fetched(request.name)
 
-            page_data = acp_ajax_request(ses, post_data)
-        except Exception:
-            log.exception("Error with request for page %s" % i)
-            page_data = []
-        
-        # Checks if there is data in request; if not, increment stop counter
-        if not page_data:
-            stop = stop + 1
-
-        # Process AJAX request into a python list
-        for row in page_data:
-            try:
-                data.append(PharmacyData(row))
-            except Exception:
-                log.exception("Error processing page %s request" % i)
-
-        i = i + 1
-    
-    log.info("PHARMACY DATA EXTRACTION COMPLETE")
+            continue
+
+        crawls.append((request, retries, pages, readyAt))
+
+    for request, retries, pages, readyAt in crawls:
+        pages.close()
+
+        ranges = checkpoint.page_ranges(request.name)
+
+        log.info(
+            "Crawl window over, %s pages saved: %s" % (
+                request.name,
+                ", ".join("%s-%s" % tuple(r) for r in ranges) or "none"
+            )
+        )
+
+    checkpoint.add_window(
+        started.strftime("%Y-%m-%dT%H:%M:%S"),
+        (datetime.datetime.now() - started).total_seconds(),
+        checkpoint.page_count() - savedPages
+    )
+
+    return all(checkpoint.is_fetched(r.name) for r in requests)
+
+def fetch_pages(ses, scheduler, pool, parser, requests, checkpoint, 
+                metrics):
+    """Saves every page of each crawl to the checkpoint only
+
+    Failed pages are not retried. A crawl with no failed pages is 
+    marked as fetched, so its pages can be merged into the sinks. 
+    Returns the pages that could not be retrieved for each crawl.
+    """
+    failedPages = {}
+
+    for request in requests:
+        retries = RetryQueue(0, 0)
+
+        for page in request_data(
+            ses, scheduler, pool, parser, request, Pipeline([]), 
+            checkpoint, retries, metrics
+        ):
+            pass
 
-    return data
+        failedPages[request.name] = retries.failed
 
-def save_data(config, pharmacist, pharmacy):
+        if not retries.failed:
+            checkpoint.mark_fetched(request.name)
+
+    return failedPages
+
+def merge_pages(checkpoint, request, pipeline):
+    """Sends every page saved for a crawl to the sinks
+
+    Returns the number of records sent.
+    """
+    total = 0
+
+    for page_data in checkpoint.replay(request.name, request.record):
+        pipeline.write(page_data)
+        total = total + len(page_data)
+
+    return total
+
+def save_partial(root, checkpoint, date, requests):
+    """Saves the records and page ranges fetched over the crawl windows
+
+    Each crawl's records are saved to a Partial CSV, and the page 
+    ranges, record counts and crawl windows to a Partial JSON, which 
+    the next window finds to continue the same extract.
+    """
+    savLoc = root.child("extracts")
+    manifest = {"date": date, "crawls": {}, "windows": checkpoint.windows()}
+
+    for request in requests:
+        pipeline = Pipeline([CSVSink(savLoc.child(
+            "%s - %s Partial.csv" % (date, request.name.capitalize())
+        ))])
+        total = merge_pages(checkpoint, request, pipeline)
+        pipeline.close()
+
+        manifest["crawls"][request.name] = {
+            "pages": checkpoint.page_ranges(request.name),
+            "records": total,
+            "fetched": checkpoint.is_fetched(request.name)
+        }
+
+    partialLoc = savLoc.child("%s - Partial.json" % date)
+
+    with open(str(partialLoc), "w") as file:
+        json.dump(manifest, file, indent=4)
+
+    log.info("Partial extract saved to %s" % partialLoc)
+
+def remove_partial(root, date):
+    """Deletes the partial extract files once the extract is merged"""
+    savLoc = root.child("extracts")
+
+    for name in ("Partial.json", "Pharmacist Partial.csv", 
+                 "Pharmacy Partial.csv"):
+        path = savLoc.child("%s - %s" % (date, name))
+
+        if path.exists():
+            os.remove(str(path))
+
+def find_partial_date(root, today, maxAge):
+    """Returns the date of an unfinished windowed extract to continue
+
+    Uses the latest Partial JSON saved no more than maxAge days before 
+    today, or today if there is none.
+    """
+    suffix = " - Partial.json"
+    dates = [
+        f[:-len(suffix)] for f in os.listdir(str(root.child("extracts")))
+        if f.endswith(suffix)
+    ]
+
+    if not dates:
+        return today
+
+    oldest = datetime.datetime.strptime(today, "%Y-%m-%d").date()
+    oldest = oldest - datetime.timedelta(days=maxAge)
+
+    if max(dates) < oldest.isoformat():
+        log.warning(
+            "Partial extract from %s is too old to continue, starting a "
+            "new extract" % max(dates)
+        )
+
+        return today
+
+    log.info("Continuing the partial extract from %s" % max(dates))
+
+    return max(dates)
+
+def report_finish(request, nextPage, lastPage, crawlDelay):
+    """Logs the planned pages and expected finish time"""
+    remaining = max(lastPage - nextPage + 1, 0)
+    finish = datetime.datetime.now() + datetime.timedelta(
+        seconds=remaining * crawlDelay
+    )
+
+    log.info(
+        "%s data has %s pages, %s left to request (expected finish %s)"
+        % (
+            request.name.capitalize(), lastPage + 1, remaining,
+            finish.strftime("%Y-%m-%d %H:%M")
+        )
+    )
+
+def get_base_url(conf):
+    """Returns the website address without a trailing slash"""
+    return conf.get("rx_list", "base_url", fallback=BASE_URL).rstrip("/")
+
+def pharmacist_request(conf):
+    """Returns the details to request pharmacist data"""
+    return DataRequest(
+        "pharmacist", "block_3", "0,0,0,0,0,0,%s", PharmacistData,
+        int(conf.get("rx_list", "pharmacist_start")),
+        int(conf.get("rx_list", "request_end")),
+        get_base_url(conf)
+    )
+
+def pharmacy_request(conf):
+    """Returns the details to request pharmacy data"""
+    return DataRequest(
+        "pharmacy", "block", "0,%s", PharmacyData,
+        int(conf.get("rx_list", "pharmacy_start")),
+        int(conf.get("rx_list", "request_end")),
+        get_base_url(conf)
+    )
+
+def open_checkpoint(root, date, replay=False):
+    """Opens the checkpoint for todays extraction
+
+    Replays are quick to repeat, so they only keep progress in memory.
+    """
+    if replay:
+        return Checkpoint(":memory:")
+
+    cpLoc = root.child("extracts").child("%s - Checkpoint.sqlite3" % date)
+
+    return Checkpoint(cpLoc)
+
+def extract_paths(root, date):
+    """Returns the pharmacist and pharmacy CSV files for a date"""
     savLoc = root.child("extracts")
     
     # Set File Names
-    pharmacistLoc = savLoc.child("%s - Pharmacist.csv" % today)
-    pharmacyLoc = savLoc.child("%s - Pharmacy.csv" % today)
+    pharmacistLoc = savLoc.child("%s - Pharmacist.csv" % date)
+    pharmacyLoc = savLoc.child("%s - Pharmacy.csv" % date)
 
-    # Write Pharmacist File as CSV
-    try:
-        with open(pharmacistLoc, "w") as file:
-            csvFile = csv.writer(
-                file,
-                delimiter=",", 
-                quotechar='"',
-                lineterminator="\n",
-                quoting=csv.QUOTE_ALL
-            )
-            
-            for p in pharmacist:
-                csvFile.writerow([
-                    p.pharmacist,
-                    p.pharmacy,
-                    p.address,
-                    p.city,
-                    p.postal,
-                    p.phone,
-                    p.fax,
-                    p.registration,
-                    p.apa,
-                    p.inject,
-                    p.restrictions
-                ])
-
-            log.info("Pharmacist data written to %s" % pharmacistLoc)
-    except Exception:
-        msg = "Error writing pharmacist data to %s" % pharmacistLoc
-        log.exception(msg)
+    return pharmacistLoc, pharmacyLoc
 
-    # Write Pharmacy File as CSV
-    try:
-        with open(pharmacyLoc, "w") as file:
-            csvFile = csv.writer(
-                file,
-                delimiter=",",
-                quotechar='"', 
-                lineterminator="\n",
-                quoting=csv.QUOTE_ALL
-            )
-            
-            for p in pharmacy:
-                csvFile.writerow([
-                     p.pharmacy,
-                     p.manager,
-                     p.address,
-                     p.city,
-                     p.postal,
-                     p.phone,
-                     p.fax
-                ])
-            
-            log.info("Pharmacy data written to %s" % pharmacyLoc)
-    except Exception:
-        msg = "Error writing pharmacy data to %s" % pharmacyLoc
-        log.exception(msg)
+def create_file_sinks(root, date, temporary=False):
+    """Returns the sinks that save pharmacist and pharmacy data to CSV
+
+    With temporary, the data is saved to a .tmp file next to each CSV 
+    file, to be moved over it once complete.
+    """
+    pharmacistLoc, pharmacyLoc = extract_paths(root, date)
+
+    if temporary:
+        pharmacistLoc = "%s.tmp" % pharmacistLoc
+        pharmacyLoc = "%s.tmp" % pharmacyLoc
 
-def upload_data(root, pharmacist, pharmacy):
-    """Upload data to MySQL Database"""
+    return (
+        CSVSink(pharmacistLoc),
+        CSVSink(pharmacyLoc)
+    )
+
+def connect_database(root, conf):
+    """Connects to the database in the private config
+
+    Setting engine = sqlite in the private config uses a local SQLite 
+    file instead of MySQL. Returns the connection, query placeholder 
+    and private config, or None if the database cannot be reached so 
+    the CSV files are still saved.
+    """
     # Obtain database credentials
     cLoc = root.parent.child("config", "python_config.cfg").absolute()
     
     config = configparser.ConfigParser()
-    config.read(cLoc)
     log.debug(cLoc)
-    db = config.get("rx_list", "db")
-    host = config.get("rx_list", "host")
-    user = config.get("rx_list", "user")
-    pw = config.get("rx_list", "password")
-    tablePharmacist = config.get("rx_list", "table_pharmacist")
-    tablePharmacy = config.get("rx_list", "table_pharmacy")
+    loadMethod = conf.get("rx_list", "db_load", fallback="insert")
+
+    try:
+        config.read(cLoc)
+        engine = config.get("rx_list", "engine", fallback="mysql")
+        db = config.get("rx_list", "db")
+    except configparser.Error:
+        log.exception("Unable to read the database settings in %s" % cLoc)
+
+        return None
 
     # Connect to database
     log.info("Connecting to %s" % db)
     
     try:
-        conn = pymysql.connect(
-            host=host,
-            user=user,
-            passwd=pw,
-            db=db,
-            charset="utf8"
-        )
+        if engine == "sqlite":
+            conn = sqlite3.connect(db, check_same_thread=False)
+            placeholder = "?"
+        else:
+            import pymysql
+
+            conn = pymysql.connect(
+                host=config.get("rx_list", "host"),
+                user=config.get("rx_list", "user"),
+                passwd=config.get("rx_list", "password"),
+                db=db,
+                charset="utf8",
+                local_infile=(loadMethod == "load_data")
+            )
+            placeholder = "%s"
         
         log.info("Successfully connected to database")
 
     except Exception:
         log.exception("Unable to connected to database %s" % db)
 
-    cursor = conn.cursor()
-    
-    # Upload data to pharmacist table
-    log.info("Uploading pharmacist data to %s" % tablePharmacist)
-    
-    # Convert pharmacist data to list of list
-    data = []
-
-    for p in pharmacist:
-        data.append((
-            p.date,
-            p.pharmacist,
-            p.pharmacy,
-            p.address,
-            p.city,
-            p.postal,
-            p.phone,
-            p.fax,
-            p.registration,
-            p.apa,
-            p.inject,
-            p.restrictions
+        return None
+
+    return conn, placeholder, config
+
+def create_database_sinks(database, conf, paths, date, validSinks=None):
+    """Returns the sinks that upload data to the database
+
+    Records are inserted in chunks as they arrive, or with db_load set 
+    to load_data the finished CSV files (paths) are loaded with LOAD 
+    DATA LOCAL INFILE (MySQL only). Unless db_staging is False, rows go
+    through a staging table and are swapped in once the day is complete.
+    With validation = block, the swap waits on the validSinks checks.
+    """
+    conn, placeholder, config = database
+    loadMethod = conf.get("rx_list", "db_load", fallback="insert")
+    chunkSize = int(conf.get("rx_list", "db_chunk_size", fallback=1000))
+    staged = conf.get("rx_list", "db_staging", fallback="True") == "True"
+    block = conf.get("rx_list", "validation", fallback="off") == "block"
+    checks = [None, None]
+
+    if validSinks and block:
+        checks = [s.check for s in validSinks]
+
+        if not staged:
+            log.warning("Uploads can only be blocked with db_staging")
+
+    if loadMethod == "load_data" and placeholder != "%s":
+        log.warning("LOAD DATA is only supported by MySQL, using inserts")
+        loadMethod = "insert"
+
+    sinks = []
+
+    for path, table, fields, check in (
+        (paths[0], "table_pharmacist", PharmacistData._fields, checks[0]),
+        (paths[1], "table_pharmacy", PharmacyData._fields, checks[1])
+    ):
+        table = config.get("rx_list", table)
+        staging = None
+
+        if staged:
+            staging = StagingTables(
+                conn, table, fields, placeholder, check
+            )
+
+        if loadMethod == "load_data":
+            sinks.append(LoadDataSink(
+                conn, table, fields, date, path, staging
+            ))
+        else:
+            sinks.append(DatabaseSink(
+                conn, table, fields, date, chunkSize, placeholder, staging
+            ))
+
+    return sinks
+
+def create_validation_sinks(root, conf, date):
+    """Returns the sinks that check the quality of each extract
+
+    With validation = report or block, a Quality JSON report is saved 
+    for each extract (and a Normalized CSV with save_normalized). 
+    Returns an empty list when validation is off.
+    """
+    mode = conf.get("rx_list", "validation", fallback="off")
+
+    if mode == "off":
+        return []
+
+    savLoc = root.child("extracts")
+    threshold = float(conf.get("rx_list", "quality_threshold", fallback=0))
+    normalize = conf.get("rx_list", "save_normalized", fallback="False")
+    registrations = [
+        value.strip() for value in conf.get(
+            "rx_list", "registration_values", fallback=""
+        ).split(",") if value.strip()
+    ]
+    sinks = []
+
+    for name, record in (
+        ("Pharmacist", PharmacistData), ("Pharmacy", PharmacyData)
+    ):
+        normalizedLoc = None
+
+        if normalize == "True":
+            normalizedLoc = savLoc.child(
+                "%s - %s Normalized.csv" % (date, name)
+            )
+
+        sinks.append(ValidationSink(
+            record, date, savLoc.child("%s - %s Quality.json" % (date, name)),
+            threshold, registrations, normalizedLoc
         ))
 
-    query1 = "INSERT INTO %s " % tablePharmacist
-    query2 = (
-        "(date, pharmacist, pharmacy, address, city, postal, phone, "
-        "fax, registration, apa, inject, restrictions) VALUES "
-        "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+    return sinks
+
+def create_change_sinks(root, database, conf, date):
+    """Returns the sinks that save the changes since the last extract
+
+    The changes are always saved to CSV and, with changes = upload, are
+    also uploaded to the changes tables in place of the full data.
+    """
+    savLoc = root.child("extracts")
+    upload = conf.get("rx_list", "changes", fallback="off") == "upload"
+    chunkSize = int(conf.get("rx_list", "db_chunk_size", fallback=1000))
+    sinks = []
+
+    for name, record, key, table in (
+        ("Pharmacist", PharmacistData, "pharmacist", 
+         "table_pharmacist_changes"),
+        ("Pharmacy", PharmacyData, "pharmacy", "table_pharmacy_changes")
+    ):
+        previous = find_previous_extract(savLoc, name, date)
+        changeLoc = savLoc.child("%s - %s Changes.csv" % (date, name))
+        outputs = [CSVSink(changeLoc)]
+
+        if upload and database:
+            conn, placeholder, config = database
+            outputs.append(DatabaseSink(
+                conn, config.get("rx_list", table), 
+                change_record(record)._fields, date, chunkSize, placeholder
+            ))
+
+        sinks.append(ChangeSink(previous, record, key, date, outputs))
+
+    return sinks
+
+def create_export_sinks(root, conf, date):
+    """Returns the pharmacist and pharmacy sinks for the export formats
+
+    The formats (csv.gz, parquet and/or sqlite) are listed in exports.
+    """
+    exports = conf.get("rx_list", "exports", fallback="")
+    names = [n.strip() for n in exports.split(",") if n.strip()]
+    savLoc = root.child("extracts")
+
+    return (
+        create_exporters(names, savLoc, date, "Pharmacist", PharmacistData),
+        create_exporters(names, savLoc, date, "Pharmacy", PharmacyData)
     )
-    query = query1 + query2
+
+def archive_extracts(root, conf, date):
+    """Folds the days extracts into the archive, if enabled"""
+    if conf.get("rx_list", "archive", fallback="False") != "True":
+        return
+
+    savLoc = root.child("extracts")
 
     try:
-        cursor.executemany(query, data)
-        log.info("Pharmacist data upload complete!")
+        archive = Archive(savLoc.child("Archive.sqlite3"))
+        add_extracts(archive, savLoc, date)
+        archive.close()
     except Exception:
-        msg = "Unable to upload pharmacist data to table %s" % tablePharmacist
-        log.exception(msg)
+        log.exception("Unable to add %s to the archive" % date)
 
-    # Upload data to pharmacy table
-    log.info("Uploading pharmacy data to %s" % tablePharmacy)
-    
-    # Convert pharmacist data to list of list
-    data = []
-
-    for p in pharmacy:
-        data.append((
-            p.date,
-            p.pharmacy,
-            p.manager,
-            p.address,
-            p.city,
-            p.postal,
-            p.phone,
-            p.fax
-        ))
+def link_extracts(root, database, conf, date):
+    """Links the days pharmacists to their pharmacy records, if enabled
+
+    With pharmacy_links = file the links are saved to a Pharmacy Links 
+    CSV, and with upload they are also uploaded to the links table. 
+    Pharmacists that cannot be linked are saved to an Unmatched CSV.
+    """
+    mode = conf.get("rx_list", "pharmacy_links", fallback="off")
+
+    if mode == "off":
+        return
+
+    savLoc = root.child("extracts")
+    chunkSize = int(conf.get("rx_list", "db_chunk_size", fallback=1000))
+    sinks = [CSVSink(savLoc.child("%s - Pharmacy Links.csv" % date))]
+
+    if mode == "upload" and database:
+        conn, placeholder, config = database
+        table = config.get("rx_list", "table_pharmacy_links", fallback="")
+
+        if table:
+            sinks.append(DatabaseSink(
+                conn, table, PharmacyLink._fields, date, chunkSize, 
+                placeholder
+            ))
+        else:
+            log.warning(
+                "No table_pharmacy_links in the private config, the "
+                "pharmacy links will not be uploaded"
+            )
 
-    query1 = "INSERT INTO %s " % tablePharmacy
-    query2 = (
-        "(date, pharmacy, manager, address, city, postal, phone, fax) "
-        "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
-    )
-    query = query1 + query2
-    
     try:
-        cursor.executemany(query, data)
-    
-        log.info("Pharmacy data upload complete!")
+        link_pharmacies(
+            savLoc, date, sinks,
+            savLoc.child("%s - Unmatched Pharmacists.csv" % date), chunkSize
+        )
+    except Exception:
+        log.exception("Unable to link the %s pharmacists" % date)
+
+def index_extracts(root, conf, date):
+    """Rebuilds the search indexes from the days extracts, if enabled"""
+    if conf.get("rx_list", "search_index", fallback="False") != "True":
+        return
+
+    try:
+        build_indexes(root.child("extracts"), date)
     except Exception:
-        msg = "Unable to upload pharmacy data to table %s" % tablePharmacy
-        log.critical(msg)
+        log.exception("Unable to index the %s extracts" % date)
+
+def save_metrics(root, metrics, conf):
+    """Saves the run metrics as JSON and for Prometheus, if enabled"""
+    try:
+        if conf.get("rx_list", "save_metrics", fallback="True") == "True":
+            metrics.write_json(
+                root.child("extracts").child(
+                    "%s - Metrics.json" % metrics.date
+                )
+            )
+
+        promLoc = conf.get("rx_list", "prometheus_file", fallback="")
+
+        if promLoc:
+            metrics.write_prometheus(promLoc)
+    except Exception:
+        log.exception("Unable to save run metrics")
+
+    for name, total in metrics.summary().items():
+        log.info(
+            "%s: %s pages, %.1f s sleeping, %.1f s on the network, "
+            "%.1f s parsing" 
+            % (
+                name.capitalize(), total["pages"], total["sleep"], 
+                total["network"], 
+                total["json"] + total["parse"] + total["records"]
+            )
+        )
+
+def run_extraction(root, conf, date, session, crawlDelay, database=None, 
+                   replay=False, budget=None):
+    """Requests, parses and saves the pharmacist and pharmacy data
+
+    Records stream from each page to the CSV files, the database (if 
+    connected) and the change sinks. Returns the pages that could not 
+    be retrieved for each crawl and the sinks whose upload was blocked
+    by validation.
+
+    Replays keep their progress in memory and do not retry, as a 
+    response missing from the cache will not appear on a retry. Every
+    page is read before any file is written, and nothing is saved if a
+    response is missing. The CSV files are written to temporary files
+    and only replace the extract once both are complete.
+
+    With a budget (in seconds), pages of both crawls are requested in 
+    turn and only checkpointed. The extract is saved as a partial one 
+    until a window has fetched every page, then the pages from every 
+    window are merged and saved as usual.
+    """
+    # One scheduler paces every request made to the website, slowing 
+    # down if it starts to struggle
+    adaptive = conf.get("rx_list", "adaptive_delay", fallback="True")
+
+    if replay or adaptive != "True":
+        scheduler = RequestScheduler(crawlDelay)
+    else:
+        scheduler = AdaptiveScheduler(
+            crawlDelay,
+            float(conf.get("rx_list", "max_crawl_delay", fallback=120)),
+            float(conf.get("rx_list", "slow_response", fallback=5)),
+            step=float(conf.get("rx_list", "backoff_step", fallback=1))
+        )
+
+    # HTML parser backend used to extract the table rows, optionally
+    # run in worker processes
+    parser = PageParser(
+        conf.get("rx_list", "parser", fallback="bs4"), date,
+        int(conf.get("rx_list", "parse_workers", fallback=0) or 0)
+    )
+
+    # Records stream from each page straight to the file and database
+    changeMode = conf.get("rx_list", "changes", fallback="off")
+    fileSinks = create_file_sinks(root, date, replay)
+
+    pharmacistSinks = [fileSinks[0]]
+    pharmacySinks = [fileSinks[1]]
+
+    # Compressed and columnar copies of the extract
+    exportSinks = create_export_sinks(root, conf, date)
+    pharmacistSinks.extend(exportSinks[0])
+    pharmacySinks.extend(exportSinks[1])
+
+    # Quality of each whole extract, checked before it is uploaded
+    validSinks = create_validation_sinks(root, conf, date)
+
+    if validSinks:
+        pharmacistSinks.append(validSinks[0])
+        pharmacySinks.append(validSinks[1])
+
+    if database and changeMode != "upload":
+        dbSinks = create_database_sinks(
+            database, conf, [s.path for s in fileSinks], date, validSinks
+        )
+        pharmacistSinks.append(dbSinks[0])
+        pharmacySinks.append(dbSinks[1])
+
+    # Changes since the previous extract
+    if changeMode != "off":
+        changeSinks = create_change_sinks(root, database, conf, date)
+        pharmacistSinks.append(changeSinks[0])
+        pharmacySinks.append(changeSinks[1])
+
+    # Saved progress from an interrupted run today
+    checkpoint = open_checkpoint(root, date, replay)
+
+    # Settings for requesting failed pages again
+    retryAttempts = int(conf.get("rx_list", "retry_attempts", fallback=3))
+    retryBackoff = float(conf.get("rx_list", "retry_backoff", fallback=30))
+
+    if replay:
+        retryAttempts = 0
+
+    failedPages = {}
+    blocked = []
+
+    # Time spent in each stage of the run
+    metrics = RunMetrics(date)
+
+    dataRequests = (
+        (pharmacist_request(conf), pharmacistSinks),
+        (pharmacy_request(conf), pharmacySinks)
+    )
+
+    # Responses are parsed and saved off the request thread
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # Replays stop before any file is touched if a response is 
+        # missing from the cache
+        if replay:
+            failedPages = fetch_pages(
+                session, scheduler, pool, parser, 
+                [request for request, sinks in dataRequests], checkpoint, 
+                metrics
+            )
+
+            if any(failedPages.values()):
+                parser.close()
+                log.error(
+                    "Responses missing from the %s cache, no files were "
+                    "changed" % date
+                )
+
+                return failedPages, blocked
+
+        # Nothing is saved but the partial extract until every page of
+        # both crawls has been fetched
+        if budget is not None and not crawl_window(
+            session, scheduler, pool, parser, 
+            [request for request, sinks in dataRequests], checkpoint, 
+            retryAttempts, retryBackoff, metrics, budget
+        ):
+            parser.close()
+            save_partial(
+                root, checkpoint, date, 
+                [request for request, sinks in dataRequests]
+            )
+            save_metrics(root, metrics, conf)
+
+            return failedPages, blocked
+
+        for request, sinks in dataRequests:
+            if checkpoint.is_complete(request.name):
+                log.info("%s data already extracted today" % request.name)
+                continue
+
+            retries = RetryQueue(retryAttempts, retryBackoff)
+
+            pipeline = Pipeline(sinks)
+
+            # Pages fetched over earlier crawl windows
+            if checkpoint.is_fetched(request.name):
+                total = merge_pages(checkpoint, request, pipeline)
+
+                log.info(
+                    "Merged %s %s records from the crawl windows" 
+                    % (total, request.name)
+                )
+            else:
+                for page in request_data(
+                    session, scheduler, pool, parser, request, pipeline, 
+                    checkpoint, retries, metrics
+                ):
+                    pass
+
+            pipeline.close()
+            blocked.extend(pipeline.blocked)
+
+            metrics.add_sinks(request.name, pipeline)
+            checkpoint.mark_complete(request.name)
+            failedPages[request.name] = retries.failed
+
+    parser.close()
+
+    # Replayed files are complete, so they can replace the extract
+    if replay:
+        for path in extract_paths(root, date):
+            os.replace("%s.tmp" % path, str(path))
+
+    # Every crawl finished, so there is nothing left to resume
+    checkpoint.remove()
+    remove_partial(root, date)
+
+    save_metrics(root, metrics, conf)
+    archive_extracts(root, conf, date)
+    index_extracts(root, conf, date)
+    link_extracts(root, database, conf, date)
+
+    # RUN SUMMARY
+    for name, pages in failedPages.items():
+        if pages:
+            log.warning(
+                "Missing %s pages: %s" 
+                % (name, ", ".join(str(p) for p in pages))
+            )
+        else:
+            log.info("All %s pages retrieved" % name)
 
-    conn.close()
+    return failedPages, blocked
 
+def crawl(root, conf, date):
+    """Extracts the data from the website and uploads it
 
-# SET UP VARIABLES
-# Get directory to main config files
-root = Path(sys.argv[1])
+    Returns False if the crawl was not allowed or validation blocked 
+    an upload.
+    """
+    # Get the program/robot/crawler name
+    robotName = conf.get("rx_list", "user_agent")
+    baseUrl = get_base_url(conf)
 
-# Get the current date
-today = get_today()
+    # Seconds between requests if set (otherwise the default is used)
+    delaySetting = conf.get("rx_list", "crawl_delay", fallback="")
 
-# Get the public config file and set the root directory
-config = configparser.ConfigParser()
-config.read(root.child("config.cfg").absolute())
+    # Minutes to crawl for before saving a partial extract, which the 
+    # next crawl continues (under its original date)
+    budgetSetting = conf.get("rx_list", "crawl_budget", fallback="")
+    budget = float(budgetSetting) * 60 if budgetSetting else None
 
-# Set up logging functions
-log = set_log_properties(config)
+    if budget is not None:
+        date = find_partial_date(
+            root, date, int(conf.get("rx_list", "max_partial_age", 
+                                     fallback=2))
+        )
 
-# Get the program/robot/crawler name
-robotName = config.get("rx_list", "user_agent")
+    # Checks ACP for permission to crawl web page
+    log.info("Checking robot.txt for permission to crawl")
 
-# PROGRAM START
-log.info("ALBERTA PHARMACIST AND PHARMACY EXTRACTION TOOL STARTED")
+    crawl = get_permission(
+        robotName, baseUrl, root.child("cache"),
+        float(conf.get("rx_list", "robots_ttl", fallback=86400)),
+        float(delaySetting) if delaySetting else None
+    )
 
-# Checks ACP for permission to crawl web page
-log.info("Checking robot.txt for permission to crawl")
+    if crawl.can != True:
+        log.info("Rejected.")
 
-crawl = get_permission(robotName)
+        return False
 
-if crawl.can == True:
     log.info("Permission to crawl granted")
     
     # EXTRACT DATA FROM WEBSITE
     # Generate session with ACP website
     log.debug("Generating session with ACP website")
 
-    session = generate_session(robotName)
-    
-    if session:
-        # Extract Pharmacist Data
-        pharmacistData = request_pharmacist_data(session, config, crawl.delay)
-        
-        # Extract Pharmacy Data
-        pharmacyData = request_pharmacy_data(session, config, crawl.delay)
-    
-    # SAVING DATA
-    # Save data to file    
-    save_data(config, pharmacistData, pharmacyData)
+    session = generate_session(robotName, baseUrl)
+
+    if not session:
+        return False
+
+    # Saved copies of the raw AJAX responses
+    if conf.get("rx_list", "cache_responses", fallback="False") == "True":
+        cache = ResponseCache(root.child("cache"), date)
+        session = RecordingSession(session, cache)
+
+    database = connect_database(root, conf)
+
+    try:
+        failedPages, blocked = run_extraction(
+            root, conf, date, session, crawl.delay, database, budget=budget
+        )
+    finally:
+        if database:
+            database[0].close()
+
+    # A blocked upload needs looking at before the data is used
+    return not blocked
+
+def replay(root, conf, date):
+    """Re-parses the responses cached on a date and re-saves the files
+
+    Responses are read from the cache with no crawl delay and nothing 
+    is uploaded. Returns False, leaving the saved files as they were, 
+    if the cache is missing or incomplete.
+    """
+    cache = ResponseCache(root.child("cache"), date)
+
+    if not os.path.isdir(cache.folder):
+        log.error("No cached responses found in %s" % cache.folder)
+
+        return False
+
+    log.info("Replaying responses saved on %s" % date)
+
+    session = ReplaySession(cache)
+    failedPages, blocked = run_extraction(
+        root, conf, date, session, 0, replay=True
+    )
+
+    return not any(failedPages.values())
+
+def upload(root, conf, date):
+    """Uploads the CSV files saved on a date to the database
+
+    Replaces any rows already uploaded for that date, without making 
+    any requests to the website.
+    """
+    database = connect_database(root, conf)
+
+    if not database:
+        return False
+
+    paths = extract_paths(root, date)
+    validSinks = create_validation_sinks(root, conf, date)
+    dbSinks = create_database_sinks(database, conf, paths, date, validSinks)
+
+    sinks = [[dbSinks[0]], [dbSinks[1]]]
+
+    if validSinks:
+        sinks = [[validSinks[0], dbSinks[0]], [validSinks[1], dbSinks[1]]]
+
+    try:
+        return save_extracts(conf, paths, date, sinks)
+    finally:
+        database[0].close()
+
+def export(root, conf, date):
+    """Saves the CSV files from a date in the configured export formats"""
+    paths = extract_paths(root, date)
+
+    return save_extracts(
+        conf, paths, date, create_export_sinks(root, conf, date)
+    )
+
+def save_extracts(conf, paths, date, sinks):
+    """Sends the records in saved CSV files to the matching sinks
+
+    Returns False if no extract was found or validation blocked an 
+    upload.
+    """
+    chunkSize = int(conf.get("rx_list", "db_chunk_size", fallback=1000))
+    saved = False
+    blocked = []
+
+    for path, record, recordSinks in zip(
+        paths, (PharmacistData, PharmacyData), sinks
+    ):
+        if not path.exists():
+            log.error("No extract found at %s" % path)
+            continue
+
+        pipeline = Pipeline(recordSinks)
+
+        for chunk in read_extract(path, record, date, chunkSize):
+            pipeline.write(chunk)
+
+        pipeline.close()
+        blocked.extend(pipeline.blocked)
+        saved = True
+
+    return saved and not blocked
+
+# Subcommands and the functions that run them
+COMMANDS = {
+    "crawl": crawl,
+    "replay": replay,
+    "upload": upload,
+    "export": export
+}
+
+def get_arguments(argv=None):
+    """Parses the command line
+
+    The original form, extract.py ROOT, is treated as the crawl 
+    command (or a replay if replay_date is set in the config).
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+
+    if argv and argv[0] not in COMMANDS and not argv[0].startswith("-"):
+        argv.insert(0, "crawl")
+
+    parser = argparse.ArgumentParser(
+        description="Extracts pharmacist and pharmacy data from the ACP "
+        "website"
+    )
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    crawlParser = commands.add_parser(
+        "crawl", help="extract the data from the website"
+    )
+    crawlParser.add_argument("root", help="folder holding config.cfg")
+    crawlParser.add_argument(
+        "--budget", type=float, 
+        help="minutes to crawl for (overrides crawl_budget)"
+    )
+
+    replayParser = commands.add_parser(
+        "replay", help="re-parse cached responses and re-save the files"
+    )
+    replayParser.add_argument("root", help="folder holding config.cfg")
+    replayParser.add_argument("date", help="date of the cache (YYYY-MM-DD)")
+
+    uploadParser = commands.add_parser(
+        "upload", help="upload saved CSV files to the database"
+    )
+    uploadParser.add_argument("root", help="folder holding config.cfg")
+    uploadParser.add_argument(
+        "date", nargs="?", help="date of the extract (default today)"
+    )
+
+    exportParser = commands.add_parser(
+        "export", help="save CSV files in the configured export formats"
+    )
+    exportParser.add_argument("root", help="folder holding config.cfg")
+    exportParser.add_argument(
+        "date", nargs="?", help="date of the extract (default today)"
+    )
+
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Runs a subcommand and returns the exit status"""
+    args = get_arguments(argv)
+
+    # Get directory to main config files
+    root = Path(args.root)
+
+    # Get the public config file and set the root directory
+    config = configparser.ConfigParser()
+    config.read(root.child("config.cfg").absolute())
+
+    command = args.command
+    date = getattr(args, "date", None)
+
+    if getattr(args, "budget", None) is not None:
+        config.set("rx_list", "crawl_budget", str(args.budget))
+
+    # A replay date in the config replays instead of crawling
+    replayDate = config.get("rx_list", "replay_date", fallback="")
+
+    if command == "crawl" and replayDate:
+        command = "replay"
+        date = replayDate
+
+    date = date or get_today()
+
+    # Set up logging functions
+    set_log_properties(root, config)
+
+    # PROGRAM START
+    log.info("ALBERTA PHARMACIST AND PHARMACY EXTRACTION TOOL STARTED")
+
+    success = COMMANDS[command](root, config, date)
+
+    log.info("ALBERTA PHARMACIST AND PHARMACY EXTRACTION TOOL COMPLETED")
+
+    return 0 if success else 1
 
-    # Upload data to database
-    upload_data(root, pharmacistData, pharmacyData)
-else:
-   log.info("Rejected.")
 
-log.info("ALBERTA PHARMACIST AND PHARMACY EXTRACTION TOOL COMPLETED")
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
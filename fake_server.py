@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+"""Local stand-in for the ACP website used for testing and benchmarks
+
+    Serves /robots.txt, the HEAD request used to start a session and
+    the /views/ajax endpoint with synthetic pharmacist and pharmacy
+    tables of a configurable size. Latency and error responses can be
+    added to exercise the retry handling.
+
+    Usage: fake_server.py [--port 8000] [--pharmacists 10000] ...
+    Then set base_url = http://127.0.0.1:8000 in config.cfg
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import random
+from socketserver import ThreadingMixIn
+import threading
+import time
+from urllib.parse import parse_qs
+
+FIRST_NAMES = (
+    "Alex", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie",
+    "Avery", "Quinn", "Parker", "Rowan", "Hayden"
+)
+LAST_NAMES = (
+    "Smith", "Nguyen", "Brown", "Tremblay", "Martin", "Roy", "Wilson",
+    "MacDonald", "Gagnon", "Lee", "Singh", "O'Neil"
+)
+CITIES = (
+    ("Edmonton", "T5"), ("Calgary", "T2"), ("Red Deer", "T4"),
+    ("Lethbridge", "T1"), ("Grande Prairie", "T8"), ("Medicine Hat", "T1")
+)
+STREETS = ("Main St", "Jasper Ave", "1 St SW", "Gateway Blvd", "Whyte Ave")
+REGISTRATIONS = ("Clinical", "Courtesy", "Provisional")
+AUTHORIZATIONS = (
+    "", "Addtl Prescribing Authorization",
+    "Administer Drugs by Injection",
+    "Addtl Prescribing Authorization<br />Administer Drugs by Injection"
+)
+
+ROW_TEMPLATE = '<tr class="%s">%s</tr>'
+TABLE_TEMPLATE = (
+    '<div class="view-content"><table class="views-table table '
+    'table-striped"><thead><tr>%s</tr></thead><tbody>%s</tbody></table>'
+    '</div>%s'
+)
+PAGER_TEMPLATE = (
+    '<ul class="pager"><li class="pager-next"><a href="/views/ajax?'
+    'page=%s">next</a></li><li class="pager-last last"><a title="Go to '
+    'last page" href="/views/ajax?page=%s">last &raquo;</a></li></ul>'
+)
+
+
+def pharmacy_location(rand, index):
+    """Returns a random pharmacy name, address and phone numbers"""
+    city, prefix = rand.choice(CITIES)
+    postal = "%s%s %s%s%s" % (
+        prefix, rand.choice("ABCEGHJKLMNPRSTVXY"), rand.randint(0, 9),
+        rand.choice("ABCEGHJKLMNPRSTVWXYZ"), rand.randint(0, 9)
+    )
+    address = "%s %s" % (rand.randint(1, 19999), rand.choice(STREETS))
+    phone = "(780) %03d-%04d" % (rand.randint(200, 999), rand.randint(0, 9999))
+    fax = "(780) %03d-%04d" % (rand.randint(200, 999), rand.randint(0, 9999))
+    name = "%s Pharmacy &amp; Wellness #%s" % (rand.choice(LAST_NAMES), index)
+
+    return name, address, city, postal, phone, fax
+
+def pharmacist_row(index):
+    """Returns the table row for a synthetic pharmacist"""
+    rand = random.Random("pharmacist-%s" % index)
+    name = "%s, %s" % (rand.choice(LAST_NAMES), rand.choice(FIRST_NAMES))
+
+    # Pharmacists work at the same locations listed in the pharmacy table
+    pharmacyIndex = rand.randint(0, 1500)
+    pharmacy, address, city, postal, phone, fax = pharmacy_location(
+        random.Random("pharmacy-%s" % pharmacyIndex), pharmacyIndex
+    )
+
+    location = (
+        "%s<br />\n%s, %s, %s<br />\n<br />\nPhone: %s<br />\nFax: %s"
+        % (pharmacy, address, city, postal, phone, fax)
+    )
+    cells = (
+        name, location, rand.choice(REGISTRATIONS),
+        rand.choice(AUTHORIZATIONS), ""
+    )
+
+    return ROW_TEMPLATE % (
+        "odd" if index % 2 else "even",
+        "".join("<td>%s</td>" % c for c in cells)
+    )
+
+def pharmacy_row(index):
+    """Returns the table row for a synthetic pharmacy"""
+    rand = random.Random("pharmacy-%s" % index)
+    pharmacy, address, city, postal, phone, fax = pharmacy_location(
+        rand, index
+    )
+    manager = "%s %s" % (rand.choice(FIRST_NAMES), rand.choice(LAST_NAMES))
+
+    location = (
+        "%s, %s, %s<br />\n<br />\n<strong>Phone:</strong>\n<span>%s</span>"
+        "<br />\n<strong>Fax:</strong><span>%s</span>"
+        % (address, city, postal, phone, fax)
+    )
+    cells = (pharmacy, manager, location)
+
+    return ROW_TEMPLATE % (
+        "odd" if index % 2 else "even",
+        "".join("<td>%s</td>" % c for c in cells)
+    )
+
+class FakeACP(object):
+    """Settings and counters for the fake website"""
+
+    def __init__(self, pharmacists=1000, pharmacies=200, perPage=50,
+                 latency=0, errorRate=0, crawlDelay=0, seed=0):
+        self.pharmacists = pharmacists
+        self.pharmacies = pharmacies
+        self.perPage = perPage
+        self.latency = latency
+        self.errorRate = errorRate
+        self.crawlDelay = crawlDelay
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def page(self, displayId, page):
+        """Returns the AJAX JSON response for a page"""
+        if displayId == "block_3":
+            count, row = self.pharmacists, pharmacist_row
+            pager = "0,0,0,0,0,0,%s"
+        else:
+            count, row = self.pharmacies, pharmacy_row
+            pager = "0,%s"
+
+        first = page * self.perPage
+        rows = "".join(
+            row(i) for i in range(first, min(first + self.perPage, count))
+        )
+
+        lastPage = max((count - 1) // self.perPage, 0)
+        pagerHtml = PAGER_TEMPLATE % (
+            (pager % (page + 1)).replace(",", "%2C"),
+            (pager % lastPage).replace(",", "%2C")
+        )
+
+        data = TABLE_TEMPLATE % ("<th>Name</th>", rows, pagerHtml)
+
+        return json.dumps([
+            {"command": "settings", "settings": {}, "merge": True},
+            {"command": "insert", "method": "replaceWith", "data": data}
+        ])
+
+    def fail(self):
+        """Returns True if this request should get an error response"""
+        with self.lock:
+            self.requests = self.requests + 1
+
+            if self.errorRate and self.random.random() < self.errorRate:
+                self.errors = self.errors + 1
+
+                return True
+
+        return False
+
+def make_handler(acp):
+    """Returns a request handler class serving the fake website"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status, body, contentType, headers=None):
+            body = body.encode("UTF-8")
+
+            self.send_response(status)
+            self.send_header("Content-Type", contentType)
+            self.send_header("Content-Length", str(len(body)))
+
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.end_headers()
+
+        def do_GET(self):
+            if self.path == "/robots.txt":
+                self.send_body(
+                    200,
+                    "User-agent: *\nCrawl-delay: %s\nDisallow: /admin/\n"
+                    % acp.crawlDelay,
+                    "text/plain"
+                )
+            else:
+                self.send_body(404, "Not Found", "text/plain")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            form = parse_qs(self.rfile.read(length).decode("UTF-8"))
+
+            if acp.latency:
+                time.sleep(acp.latency)
+
+            if not self.path.startswith("/views/ajax"):
+                self.send_body(404, "Not Found", "text/plain")
+            elif acp.fail():
+                self.send_body(
+                    503, "Service Unavailable", "text/plain",
+                    {"Retry-After": "0"}
+                )
+            else:
+                displayId = form.get("view_display_id", [""])[0]
+                page = int(form.get("page", ["0"])[0].split(",")[-1])
+
+                self.send_body(
+                    200, acp.page(displayId, page), "application/json"
+                )
+
+    return Handler
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+def start_server(acp, port=0):
+    """Starts the fake website on a background thread
+
+    Returns the server, whose server_address gives the port used.
+    """
+    server = ThreadingServer(("127.0.0.1", port), make_handler(acp))
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+def argument_parser(add_help=True):
+    """Returns the parser for the fake website's command line settings
+
+    Without help it can be used as a parent of another parser, so the
+    benchmarks accept the same settings.
+    """
+    parser = argparse.ArgumentParser(
+        description="Fake ACP website", add_help=add_help
+    )
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--pharmacists", type=int, default=1000)
+    parser.add_argument("--pharmacies", type=int, default=200)
+    parser.add_argument("--per-page", type=int, default=50)
+    parser.add_argument(
+        "--latency", type=float, default=0,
+        help="seconds to wait before answering each AJAX request"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0,
+        help="fraction of AJAX requests answered with a 503 error"
+    )
+    parser.add_argument("--crawl-delay", type=float, default=0)
+
+    return parser
+
+def get_arguments(argv=None):
+    """Parses the command line settings for the fake website"""
+    return argument_parser().parse_args(argv)
+
+def acp_from_arguments(args):
+    """Creates the fake website settings from the parsed arguments"""
+    return FakeACP(
+        args.pharmacists, args.pharmacies, args.per_page, args.latency,
+        args.error_rate, args.crawl_delay
+    )
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    server = start_server(acp_from_arguments(args), args.port)
+
+    print("Serving fake ACP website on http://127.0.0.1:%s" % args.port)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
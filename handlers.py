@@ -1,4 +1,7 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import datetime
 from unipath import Path
 
@@ -15,4 +18,29 @@ class NewFileHandler(logging.FileHandler):
         # Takes the provided path and appends the date as the log name
         filename = Path(filepath, "%s.log" % date).absolute()
 
-        super(NewFileHandler,self).__init__(filename, mode)
\ No newline at end of file
+        super(NewFileHandler,self).__init__(filename, mode)
+
+def start_queue_logging(logger=None):
+    """Moves the logger's handlers onto a background thread
+
+    The logger is left with a QueueHandler, so logging a message only
+    puts it on a queue and file writes never hold up the caller. The
+    original handlers run on a QueueListener thread, which is stopped
+    (writing any queued messages) when the program exits.
+    """
+    logger = logger or logging.getLogger()
+    handlers = logger.handlers[:]
+
+    for handler in handlers:
+        logger.removeHandler(handler)
+
+    logQueue = queue.Queue(-1)
+    logger.addHandler(logging.handlers.QueueHandler(logQueue))
+
+    listener = logging.handlers.QueueListener(
+        logQueue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+
+    return listener
\ No newline at end of file
@@ -0,0 +1,176 @@
+from collections import Counter, namedtuple
+import html
+import logging
+import os
+import re
+
+from changes import record_hash
+from records import PharmacistData, PharmacyData, read_extract
+from sinks import CSVSink, Pipeline
+
+log = logging.getLogger(__name__)
+
+# A pharmacist's link to the pharmacy record they are listed at
+PharmacyLink = namedtuple(
+    "PharmacyLink", ("date", "pharmacist", "registration", "pharmacy",
+                     "manager", "pharmacy_key", "match")
+)
+
+# Pharmacist rows that could not be linked, with the reason
+UnmatchedPharmacist = namedtuple(
+    "UnmatchedPharmacist", ("date", "reason") + PharmacistData._fields[1:]
+)
+
+# How a link was made: on name, postal code and address, or on just
+# the address or just the name when only one pharmacy has it
+EXACT = "exact"
+ADDRESS = "address"
+NAME = "name"
+
+# Reasons a pharmacist with a pharmacy is left unlinked
+NOT_FOUND = "not found"
+AMBIGUOUS = "ambiguous"
+
+PUNCTUATION = re.compile(r"[^\w ]+")
+
+
+def match_text(text):
+    """Returns text as compared when matching
+
+    Entities are unescaped, punctuation removed and the words lower
+    cased and separated by single spaces, so "Rx &amp; Co." and
+    "RX & Co" compare equal.
+    """
+    text = PUNCTUATION.sub(" ", html.unescape(str(text)))
+
+    return " ".join(text.lower().split())
+
+def match_postal(text):
+    """Returns a postal code in upper case without spaces"""
+    return "".join(str(text).upper().split())
+
+def pharmacy_key(name, address, postal):
+    """Returns the hex key identifying a pharmacy location
+
+    Pharmacist and pharmacy records at the same location get the same
+    key, so downstream tables can be joined on it directly.
+    """
+    return record_hash(
+        (match_text(name), match_postal(postal), match_text(address))
+    ).hex()
+
+class PharmacyIndex(object):
+    """Finds the pharmacy record for a pharmacist's listed location
+
+    Pharmacies are looked up by their full key first. If the name is
+    written differently, a pharmacy at the same address and postal
+    code is used, then one with the same name and postal code, but
+    only when exactly one pharmacy matches.
+    """
+
+    def __init__(self, pharmacies):
+        self.keys = {}
+        self.addresses = {}
+        self.names = {}
+
+        for r in pharmacies:
+            key = pharmacy_key(r.pharmacy, r.address, r.postal)
+            postal = match_postal(r.postal)
+
+            self.keys.setdefault(key, r)
+            self.addresses.setdefault(
+                (postal, match_text(r.address)), []
+            ).append((key, r))
+            self.names.setdefault(
+                (postal, match_text(r.pharmacy)), []
+            ).append((key, r))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def match(self, pharmacist):
+        """Returns the key, pharmacy record and match kind or reason
+
+        The key and record are None if no single pharmacy matches, in
+        which case the reason is returned instead of the match kind.
+        """
+        key = pharmacy_key(
+            pharmacist.pharmacy, pharmacist.address, pharmacist.postal
+        )
+
+        if key in self.keys:
+            return key, self.keys[key], EXACT
+
+        postal = match_postal(pharmacist.postal)
+        reason = NOT_FOUND
+
+        for index, kind, text in (
+            (self.addresses, ADDRESS, pharmacist.address),
+            (self.names, NAME, pharmacist.pharmacy)
+        ):
+            candidates = index.get((postal, match_text(text)), [])
+
+            if len(candidates) == 1:
+                return candidates[0] + (kind,)
+            elif candidates:
+                reason = AMBIGUOUS
+
+        return None, None, reason
+
+def link_pharmacies(folder, date, sinks, unmatchedPath, chunkSize=1000):
+    """Links the pharmacists in a day's extract to the pharmacy records
+
+    PharmacyLinks are sent to the sinks for every pharmacist listed at
+    a pharmacy, and the rows that cannot be linked are saved to the
+    unmatched CSV with the reason. Pharmacists without a pharmacy are
+    left out of both. Returns a Counter of the match kinds and reasons.
+    """
+    paths = [
+        os.path.join(str(folder), "%s - %s.csv" % (date, name))
+        for name in ("Pharmacist", "Pharmacy")
+    ]
+
+    index = PharmacyIndex(
+        r for chunk in read_extract(paths[1], PharmacyData, date)
+        for r in chunk
+    )
+
+    pipeline = Pipeline(sinks)
+    unmatched = Pipeline([CSVSink(unmatchedPath)])
+    counts = Counter()
+
+    for chunk in read_extract(paths[0], PharmacistData, date, chunkSize):
+        links = []
+        missing = []
+
+        for r in chunk:
+            if not r.pharmacy:
+                continue
+
+            key, pharmacy, match = index.match(r)
+            counts[match] = counts[match] + 1
+
+            if pharmacy is None:
+                missing.append(UnmatchedPharmacist(date, match, *r[1:]))
+            else:
+                links.append(PharmacyLink(
+                    date, r.pharmacist, r.registration, pharmacy.pharmacy,
+                    pharmacy.manager, key, match
+                ))
+
+        pipeline.write(links)
+        unmatched.write(missing)
+
+    pipeline.close()
+    unmatched.close()
+
+    linked = counts[EXACT] + counts[ADDRESS] + counts[NAME]
+
+    log.info(
+        "Linked %s of %s pharmacists to %s pharmacies (%s by address, %s "
+        "by name), %s not found and %s ambiguous"
+        % (linked, sum(counts.values()), len(index), counts[ADDRESS],
+           counts[NAME], counts[NOT_FOUND], counts[AMBIGUOUS])
+    )
+
+    return counts
@@ -0,0 +1,182 @@
+from collections import namedtuple
+from functools import lru_cache
+import html
+import re
+
+# Canadian postal code (D, F, I, O, Q and U are never used and W and Z
+# never start a code)
+POSTAL_CODE = re.compile(
+    r"[ABCEGHJ-NPRSTVXY]\d[ABCEGHJ-NPRSTV-Z] ?\d[ABCEGHJ-NPRSTV-Z]\d"
+)
+NON_DIGITS = re.compile(r"\D")
+
+# Labels before the phone and fax numbers in the pharmacy table
+PHONE_LABEL = "Phone:"
+FAX_LABEL = "Fax:"
+
+# Distinct location cells to keep parsed results for
+CACHE_SIZE = 8192
+
+Location = namedtuple(
+    "Location", ("pharmacy", "address", "city", "postal", "phone", "fax",
+                 "problems")
+)
+
+
+class LocationError(ValueError):
+    """Describes a location detail that failed validation"""
+    pass
+
+def split_address(text):
+    """Splits an "address, city, postal code" line into its parts"""
+    # Postal Code is the last content after the final comma
+    comma_pos = text.rfind(",")
+    postal = text[comma_pos + 2:]
+    text = text[0:comma_pos].strip()
+
+    # City is now the last content after the final comma
+    comma_pos = text.rfind(",")
+    city = text[comma_pos + 2:]
+
+    # Address is the remaining information
+    address = text[0:comma_pos]
+
+    return address, city, postal
+
+def parse_address(text, problems):
+    """Splits and checks an address line
+
+    A line without an address, city and postal code is kept whole as
+    the address. Otherwise the split parts are kept and a postal code
+    that is not valid (in any case, with or without spaces) is recorded
+    as a problem.
+    """
+    if text.count(",") < 2:
+        problems.append(("city and postal", LocationError(
+            "%r does not end with a city and postal code" % text
+        )))
+
+        return text, "", ""
+
+    address, city, postal = split_address(text)
+
+    if not POSTAL_CODE.fullmatch("".join(postal.split()).upper()):
+        problems.append(("postal", LocationError(
+            "%r is not a valid postal code" % postal
+        )))
+
+    return address, city, postal
+
+def check_phone(field, text, problems):
+    """Records a problem if a phone or fax number is the wrong length"""
+    digits = NON_DIGITS.sub("", text)
+
+    if digits.startswith("1"):
+        digits = digits[1:]
+
+    if text and len(digits) != 10:
+        problems.append((field, LocationError(
+            "%r is not a 10 digit number" % text
+        )))
+
+def labelled_value(lines, label, index):
+    """Returns the first line with text after a label
+
+    Falls back to the line at the usual index if the label is missing.
+    Returns None if neither is found.
+    """
+    try:
+        start = lines.index(label) + 1
+    except ValueError:
+        return lines[index] if index < len(lines) else None
+
+    for line in lines[start:]:
+        if line:
+            return line
+
+    return None
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_pharmacist_location(lines):
+    """Returns the Location in a pharmacist's pharmacy cell
+
+    Takes the stripped lines of the cell: the pharmacy name, the
+    address line, a blank line, then the phone and fax lines. Many
+    pharmacists work at the same pharmacy, so results are cached by
+    the lines.
+    """
+    problems = []
+
+    if not lines:
+        problems.append(("pharmacy", LocationError("Cell is empty")))
+
+        return Location("", "", "", "", "", "", tuple(problems))
+
+    pharmacy = html.unescape(lines[0])
+
+    # Details are only listed for a pharmacy
+    if not pharmacy:
+        return Location("", "", "", "", "", "", ())
+
+    address = ""
+    city = ""
+    postal = ""
+    phone = ""
+    fax = ""
+
+    if len(lines) > 1:
+        address, city, postal = parse_address(
+            html.unescape(lines[1]), problems
+        )
+    else:
+        problems.append(("address", LocationError("No address line")))
+
+    if len(lines) > 3:
+        phone = NON_DIGITS.sub("", lines[3])
+        check_phone("phone", phone, problems)
+    else:
+        problems.append(("phone", LocationError("No phone line")))
+
+    if len(lines) > 4:
+        fax = NON_DIGITS.sub("", lines[4])
+        check_phone("fax", fax, problems)
+    else:
+        problems.append(("fax", LocationError("No fax line")))
+
+    return Location(pharmacy, address, city, postal, phone, fax,
+                    tuple(problems))
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_pharmacy_location(lines):
+    """Returns the Location in a pharmacy's location and contact cell
+
+    Takes the stripped lines of the cell: the address line, then the
+    labelled phone and fax numbers. The numbers are found after their
+    labels (or at their usual positions if a label is missing). The
+    pharmacy name is in a separate cell, so is left blank.
+    """
+    problems = []
+    address = ""
+    city = ""
+    postal = ""
+
+    if lines:
+        address, city, postal = parse_address(
+            html.unescape(lines[0]), problems
+        )
+    else:
+        problems.append(("address", LocationError("Cell is empty")))
+
+    # Phone is typically the sixth entry and fax the ninth
+    phone = labelled_value(lines, PHONE_LABEL, 5)
+    fax = labelled_value(lines, FAX_LABEL, 8)
+
+    for field, value in (("phone", phone), ("fax", fax)):
+        if value is None:
+            problems.append((field, LocationError("No %s number" % field)))
+        else:
+            check_phone(field, value, problems)
+
+    return Location(
+        "", address, city, postal, phone or "", fax or "", tuple(problems)
+    )
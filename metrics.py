@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Per page timings, in the order they happen
+PAGE_STAGES = ("sleep", "network", "json", "parse", "records")
+
+
+class RunMetrics(object):
+    """Timings and counts collected over one extraction run
+
+    Page timings are added from both the request thread (sleep and
+    network) and the writer thread (JSON decoding, HTML parsing and
+    record building), so every update is made under a lock. Repeated
+    requests for the same page (retries) add to its earlier timings.
+    """
+
+    def __init__(self, date):
+        self.date = date
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.pages = {}
+        self.sinks = {}
+
+    def add_page(self, crawl, page, rows=None, **timings):
+        """Adds stage timings (in seconds) and rows found for a page"""
+        with self.lock:
+            entry = self.pages.setdefault((crawl, page), {
+                "crawl": crawl, "page": page, "requests": 0, "rows": 0
+            })
+
+            if "network" in timings:
+                entry["requests"] = entry["requests"] + 1
+
+            if rows is not None:
+                entry["rows"] = rows
+
+            for stage, seconds in timings.items():
+                entry[stage] = entry.get(stage, 0) + seconds
+
+    def add_sinks(self, crawl, pipeline):
+        """Adds the rows and time spent in each sink of a pipeline"""
+        with self.lock:
+            for name, (rows, seconds) in pipeline.timings.items():
+                entry = self.sinks.setdefault(name, {
+                    "crawl": crawl, "rows": 0, "seconds": 0
+                })
+                entry["rows"] = entry["rows"] + rows
+                entry["seconds"] = entry["seconds"] + seconds
+
+    def summary(self):
+        """Returns the run totals for each crawl"""
+        crawls = {}
+
+        with self.lock:
+            for entry in self.pages.values():
+                total = crawls.setdefault(entry["crawl"], dict(
+                    [("pages", 0), ("requests", 0), ("rows", 0)]
+                    + [(stage, 0) for stage in PAGE_STAGES]
+                ))
+                total["pages"] = total["pages"] + 1
+
+                for key in ("requests", "rows") + PAGE_STAGES:
+                    total[key] = total[key] + entry.get(key, 0)
+
+        return crawls
+
+    def to_dict(self):
+        """Returns every metric in a JSON serializable form"""
+        with self.lock:
+            pages = sorted(
+                self.pages.values(), key=lambda p: (p["crawl"], p["page"])
+            )
+            sinks = dict((name, dict(s)) for name, s in self.sinks.items())
+
+        return {
+            "date": self.date,
+            "started": self.started,
+            "seconds": time.perf_counter() - self.start,
+            "crawls": self.summary(),
+            "sinks": sinks,
+            "pages": pages
+        }
+
+    def write_json(self, path):
+        """Saves every metric, including the per page timings"""
+        with open(str(path), "w") as file:
+            json.dump(self.to_dict(), file, indent=4)
+
+        log.info("Metrics written to %s" % path)
+
+    def write_prometheus(self, path):
+        """Saves the run totals for the node exporter textfile collector
+
+        The file is written under a temporary name and renamed so the
+        collector never reads a partial file.
+        """
+        data = self.to_dict()
+        lines = [
+            "# HELP rx_list_run_seconds Duration of the last extraction.",
+            "# TYPE rx_list_run_seconds gauge",
+            "rx_list_run_seconds %s" % data["seconds"],
+            "# HELP rx_list_last_run_timestamp_seconds Start of the last "
+            "extraction.",
+            "# TYPE rx_list_last_run_timestamp_seconds gauge",
+            "rx_list_last_run_timestamp_seconds %s" % data["started"]
+        ]
+
+        for name, help in (
+            ("pages", "Pages extracted in the last run."),
+            ("requests", "Requests made in the last run."),
+            ("rows", "Records found in the last run.")
+        ):
+            lines.append("# HELP rx_list_%s %s" % (name, help))
+            lines.append("# TYPE rx_list_%s gauge" % name)
+
+            for crawl, total in sorted(data["crawls"].items()):
+                lines.append(
+                    'rx_list_%s{crawl="%s"} %s' % (name, crawl, total[name])
+                )
+
+        lines.append(
+            "# HELP rx_list_stage_seconds Time spent in each page stage "
+            "in the last run."
+        )
+        lines.append("# TYPE rx_list_stage_seconds gauge")
+
+        for crawl, total in sorted(data["crawls"].items()):
+            for stage in PAGE_STAGES:
+                lines.append(
+                    'rx_list_stage_seconds{crawl="%s",stage="%s"} %s'
+                    % (crawl, stage, total[stage])
+                )
+
+        for name, help in (
+            ("rows", "Records written to each sink in the last run."),
+            ("seconds", "Time spent writing to each sink in the last run.")
+        ):
+            lines.append("# HELP rx_list_sink_%s %s" % (name, help))
+            lines.append("# TYPE rx_list_sink_%s gauge" % name)
+
+            for sink, total in sorted(data["sinks"].items()):
+                lines.append(
+                    'rx_list_sink_%s{crawl="%s",sink="%s"} %s'
+                    % (name, total["crawl"], escape_label(sink), total[name])
+                )
+
+        tempPath = "%s.tmp" % path
+
+        with open(tempPath, "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+        os.replace(tempPath, str(path))
+
+        log.info("Prometheus metrics written to %s" % path)
+
+def escape_label(value):
+    """Escapes a Prometheus label value"""
+    return (
+        str(value).replace("\\", "\\\\").replace("\"", "\\\"")
+        .replace("\n", "\\n")
+    )
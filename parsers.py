@@ -0,0 +1,236 @@
+import json
+import re
+from urllib.parse import unquote
+
+# Table rows holding the pharmacist or pharmacy data
+ROW_SELECTOR = "table.table-striped tbody tr"
+ROW_XPATH = (
+    "//table[contains(concat(' ', normalize-space(@class), ' '), "
+    "' table-striped ')]//tbody//tr"
+)
+
+# Pager links and result summary used to find the number of pages
+PAGER_LAST = re.compile(
+    r'<li [^>]*class="[^"]*\bpager-last\b[^"]*"[^>]*>\s*'
+    r'<a [^>]*href="([^"]*)"'
+)
+PAGE_PARAM = re.compile(r"[?&;]page=([0-9,%A-Fa-f]+)")
+RESULT_SUMMARY = re.compile(
+    r"Displaying\s+(\d+)\s*-\s*(\d+)\s+of\s+(\d[\d,]*)", re.IGNORECASE
+)
+
+# ASCII whitespace removed by bytes.strip()
+WHITESPACE = " \t\n\r\x0b\x0c"
+
+# Elements BeautifulSoup renders as self-closing tags
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen",
+    "link", "menuitem", "meta", "param", "source", "track", "wbr",
+    "basefont", "bgsound", "command", "frame", "image", "isindex",
+    "nextid", "spacer"
+}
+
+# Whitespace-only strings BeautifulSoup collapses outside of these tags
+PRESERVE_WHITESPACE = {"pre", "textarea"}
+SPACES = "\x20\x0a\x09\x0c\x0d"
+
+# Attributes BeautifulSoup splits on whitespace and rejoins with spaces
+LIST_ATTRIBUTES = {"class", "accesskey", "dropzone", "rel", "rev", "headers"}
+
+# Attributes lxml fills in with their own name when written without a
+# value (disabled becomes disabled="disabled"), where BeautifulSoup
+# leaves them empty
+BOOLEAN_ATTRIBUTES = {
+    "checked", "compact", "declare", "defer", "disabled", "ismap",
+    "multiple", "nohref", "noresize", "noshade", "nowrap", "readonly",
+    "selected"
+}
+
+
+def get_table_html(text):
+    """Returns the HTML fragment from the AJAX response text"""
+    json_response = json.loads(text)
+
+    return json_response[1]["data"]
+
+def get_last_page(html):
+    """Returns the index of the last page listed in the response
+
+    Uses the "last" pager link if present, otherwise the result summary
+    (e.g. "Displaying 1 - 20 of 2345"). Returns None if neither is found.
+    """
+    match = PAGER_LAST.search(html)
+
+    if match:
+        page = PAGE_PARAM.search(match.group(1).replace("&amp;", "&"))
+
+        if page:
+            # The requested pager is the last one in the page parameter
+            return int(unquote(page.group(1)).split(",")[-1])
+
+    match = RESULT_SUMMARY.search(html)
+
+    if match:
+        first, last, total = match.groups()
+        perPage = int(last) - int(first) + 1
+        total = int(total.replace(",", ""))
+
+        # A short final page does not show the full page size
+        if perPage > 0 and int(last) < total:
+            return (total - 1) // perPage
+
+    return None
+
+class SoupRow(object):
+    """Table row parsed with BeautifulSoup"""
+
+    def __init__(self, row):
+        # Data is contained within the table cells
+        self.cells = row.find_all("td")
+
+    def contents(self, i):
+        """Returns the HTML contents of a cell"""
+        return self.cells[i].encode_contents().strip().decode("UTF-8")
+
+    def strings(self, i):
+        """Returns the text segments of a cell"""
+        return list(self.cells[i].strings)
+
+def parse_bs4(html):
+    """Extracts the table rows with BeautifulSoup"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "lxml")
+
+    return [SoupRow(row) for row in soup.select(ROW_SELECTOR)]
+
+def escape(text):
+    """Escapes text the same way as the BeautifulSoup minimal formatter"""
+    return (
+        text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    )
+
+def collapse(text, preserve):
+    """Collapses whitespace-only strings the same way as BeautifulSoup"""
+    if preserve or text.strip(SPACES):
+        return text
+    elif "\n" in text:
+        return "\n"
+    else:
+        return " "
+
+def iter_strings(element, preserve=False):
+    """Yields the text segments of an lxml element like BeautifulSoup"""
+    preserve = preserve or element.tag in PRESERVE_WHITESPACE
+
+    if element.text and isinstance(element.tag, str):
+        yield collapse(element.text, preserve)
+
+    for child in element:
+        for text in iter_strings(child, preserve):
+            yield text
+
+        if child.tail:
+            yield collapse(child.tail, preserve)
+
+def render_attribute(key, value):
+    """Renders an attribute the same way as BeautifulSoup
+
+    lxml cannot tell disabled from disabled="disabled", so both are
+    rendered as disabled="" to match the usual, minimized form.
+    """
+    if key in BOOLEAN_ATTRIBUTES and value == key:
+        value = ""
+    elif key in LIST_ATTRIBUTES:
+        value = " ".join(value.split())
+
+    value = escape(value)
+
+    if '"' in value:
+        if "'" in value:
+            value = '"%s"' % value.replace('"', "&quot;")
+        else:
+            value = "'%s'" % value
+    else:
+        value = '"%s"' % value
+
+    return "%s=%s" % (key, value)
+
+def render_contents(element, preserve=False):
+    """Serializes the children of an lxml element like BeautifulSoup"""
+    parts = []
+    preserve = preserve or element.tag in PRESERVE_WHITESPACE
+
+    if element.text:
+        parts.append(escape(collapse(element.text, preserve)))
+
+    for child in element:
+        tag = child.tag
+
+        if not isinstance(tag, str):
+            # Comments and processing instructions
+            if child.text is not None and tag.__name__ == "Comment":
+                parts.append("<!--%s-->" % collapse(child.text, preserve))
+        else:
+            # BeautifulSoup outputs attributes in alphabetical order
+            attributes = "".join(
+                " " + render_attribute(key, value)
+                for key, value in sorted(child.items())
+            )
+
+            if tag in VOID_ELEMENTS and not len(child) and not child.text:
+                parts.append("<%s%s/>" % (tag, attributes))
+            else:
+                parts.append("<%s%s>%s</%s>" % (
+                    tag, attributes, render_contents(child, preserve), tag
+                ))
+
+        if child.tail:
+            parts.append(escape(collapse(child.tail, preserve)))
+
+    return "".join(parts)
+
+class LxmlRow(object):
+    """Table row parsed with lxml"""
+
+    def __init__(self, row, cellPath):
+        self.cells = cellPath(row)
+
+    def contents(self, i):
+        """Returns the HTML contents of a cell"""
+        return render_contents(self.cells[i]).strip(WHITESPACE)
+
+    def strings(self, i):
+        """Returns the text segments of a cell"""
+        return list(iter_strings(self.cells[i]))
+
+class LxmlParser(object):
+    """Extracts the table rows with precompiled lxml XPath expressions"""
+
+    def __init__(self):
+        from lxml import etree
+
+        self.htmlParser = etree.HTMLParser()
+        self.fromstring = etree.fromstring
+        self.rowPath = etree.XPath(ROW_XPATH)
+        self.cellPath = etree.XPath(".//td")
+
+    def __call__(self, html):
+        if not html.strip():
+            return []
+
+        tree = self.fromstring(html, self.htmlParser)
+
+        if tree is None:
+            return []
+
+        return [LxmlRow(row, self.cellPath) for row in self.rowPath(tree)]
+
+def get_parser(name):
+    """Returns the row parser for the named backend (bs4 or lxml)"""
+    if name == "bs4":
+        return parse_bs4
+    elif name == "lxml":
+        return LxmlParser()
+    else:
+        raise ValueError("Unknown parser backend: %s" % name)
@@ -0,0 +1,216 @@
+from collections import Counter, namedtuple
+import csv
+import html
+import logging
+import time
+
+from locations import parse_pharmacist_location, parse_pharmacy_location
+from parsers import get_parser, get_table_html, get_last_page
+
+log = logging.getLogger(__name__)
+
+# Record fields in database column order (CSV files omit the date)
+PHARMACIST_FIELDS = (
+    "date", "pharmacist", "pharmacy", "address", "city", "postal", "phone",
+    "fax", "registration", "apa", "inject", "restrictions"
+)
+PHARMACY_FIELDS = (
+    "date", "pharmacy", "manager", "address", "city", "postal", "phone", "fax"
+)
+
+# Fields saved as numbers (CSV files hold them as text)
+INTEGER_FIELDS = ("apa", "inject")
+
+# Row parsers created in this process, by backend name
+rowParsers = {}
+
+
+class ParseProblems(object):
+    """Fields that could not be parsed, counted by field and error type
+
+    Collected for a whole page and logged as one line per kind of
+    problem, instead of a traceback for every row. Only the first
+    record name is kept for each kind as an example.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.examples = {}
+
+    def __len__(self):
+        return sum(self.counts.values())
+
+    def add(self, field, name, error):
+        """Counts a field that could not be parsed for the named record"""
+        key = (field, type(error).__name__)
+        self.counts[key] = self.counts[key] + 1
+        self.examples.setdefault(key, (name, str(error)))
+
+    def log(self, crawl, page):
+        """Logs a warning for each kind of problem found on the page"""
+        for (field, errorType), count in sorted(self.counts.items()):
+            name, message = self.examples[(field, errorType)]
+
+            log.warning(
+                "Page %s of %s data: unable to parse %s for %s record(s) "
+                "(%s: %s, e.g. %s)"
+                % (page, crawl, field, count, errorType, message, name)
+            )
+
+def add_problem(problems, field, name, error):
+    """Counts a parsing problem, or logs it if there is no counter"""
+    if problems is None:
+        log.warning("Unable to parse %s for %s (%r)" % (field, name, error))
+    else:
+        problems.add(field, name, error)
+
+class PharmacistData(namedtuple("PharmacistData", PHARMACIST_FIELDS)):
+    """Pharmacist details from one row of the pharmacist table"""
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, row, date, problems=None):
+        """Takes a row of pharmacist table data and converts to record
+
+        Fields that cannot be parsed are left blank and counted in the
+        problems (a ParseProblems), or logged if none is given.
+        """
+        # Pharmacist Name
+        pharmacist = row.contents(0)
+
+        # Pharmacy, Address, City, Postal Code, Phone and Fax (cached,
+        # as many pharmacists share a pharmacy)
+        location = parse_pharmacist_location(
+            tuple(line.strip() for line in row.strings(1))
+        )
+
+        for field, error in location.problems:
+            add_problem(problems, field, pharmacist, error)
+
+        # Registration Status
+        registration = row.contents(2)
+
+        # Authorizations
+        authorizations = row.contents(3)
+
+        if "Addtl Prescribing Authorization" in authorizations:
+            apa = 1
+        else:
+            apa = 0
+
+        if "Administer Drugs by Injection" in authorizations:
+            inject = 1
+        else:
+            inject = 0
+
+        # Restrictions
+        restrictions = row.contents(4)
+
+        return cls(
+            date, pharmacist, location.pharmacy, location.address, 
+            location.city, location.postal, location.phone, location.fax,
+            registration, apa, inject, restrictions
+        )
+
+class PharmacyData(namedtuple("PharmacyData", PHARMACY_FIELDS)):
+    """Pharmacy details from one row of the pharmacy table"""
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, row, date, problems=None):
+        """Extracts pharmacy details from the table row
+
+        Fields that cannot be parsed are left blank and counted in the
+        problems (a ParseProblems), or logged if none is given.
+        """
+        # Pharmacy Name
+        pharmacy = row.contents(0)
+        pharmacy = html.unescape(pharmacy)
+
+        # Manager
+        manager = row.contents(1)
+
+        # Location, Phone, Fax are all in one cell
+        location = parse_pharmacy_location(
+            tuple(line.strip() for line in row.strings(2))
+        )
+
+        for field, error in location.problems:
+            add_problem(problems, field, pharmacy, error)
+
+        return cls(
+            date, pharmacy, manager, location.address, location.city, 
+            location.postal, location.phone, location.fax
+        )
+
+# Every field except the date defaults to blank
+PharmacistData.__new__.__defaults__ = (
+    ("",) * 8 + (0, 0, "")
+)
+PharmacyData.__new__.__defaults__ = ("",) * 7
+
+def parse_page(text, page, parserName, record, date):
+    """Converts an AJAX response into records
+
+    Returns the records, the last page index listed in the response
+    (None if it was not found), the seconds spent decoding the JSON,
+    parsing the HTML and building the records, and the ParseProblems
+    found. Rows that cannot be converted are counted and skipped. The
+    parser backend is given by name so pages can be parsed in worker
+    processes, which each create their own parser when first used.
+    """
+    parser = rowParsers.get(parserName)
+
+    if parser is None:
+        parser = rowParsers[parserName] = get_parser(parserName)
+
+    # Extracts the table HTML from the JSON response
+    start = time.perf_counter()
+    tableHtml = get_table_html(text)
+    decoded = time.perf_counter()
+
+    rows = parser(tableHtml)
+    parsed = time.perf_counter()
+
+    data = []
+    problems = ParseProblems()
+
+    for index, row in enumerate(rows):
+        try:
+            data.append(record.from_row(row, date, problems))
+        except Exception as e:
+            problems.add("row", "row %s" % index, e)
+
+    timings = {
+        "json": decoded - start,
+        "parse": parsed - decoded,
+        "records": time.perf_counter() - parsed
+    }
+
+    # Pager details to plan the remaining requests
+    return data, get_last_page(tableHtml), timings, problems
+
+def read_extract(path, record, date, chunkSize=1000):
+    """Yields the records saved in an extract CSV file in chunks
+
+    The CSV files leave out the date, so it is added back to each
+    record.
+    """
+    integers = [i for i, f in enumerate(record._fields) if f in INTEGER_FIELDS]
+    chunk = []
+
+    with open(str(path), "r") as file:
+        for row in csv.reader(file):
+            values = [date] + row
+
+            for i in integers:
+                values[i] = int(values[i])
+
+            chunk.append(record(*values))
+
+            if len(chunk) >= chunkSize:
+                yield chunk
+                chunk = []
+
+    if chunk:
+        yield chunk
@@ -0,0 +1,100 @@
+import logging
+import os
+import re
+import time
+from urllib import robotparser
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+log = logging.getLogger(__name__)
+
+# Characters replaced when a site address is used as a file name
+UNSAFE = re.compile(r"[^\w.-]+")
+
+
+def fetch_robots(url, agent):
+    """Returns the text of a robots.txt file
+
+    Follows the same rules as RobotFileParser.read: a 401 or 403
+    response disallows everything and any other 4xx response allows
+    everything.
+    """
+    try:
+        request = Request(url, headers={"User-Agent": agent})
+
+        with urlopen(request, timeout=60) as response:
+            return response.read().decode("UTF-8", "replace")
+    except HTTPError as e:
+        if e.code in (401, 403):
+            return "User-agent: *\nDisallow: /\n"
+        elif 400 <= e.code < 500:
+            return ""
+
+        raise
+
+def robots_cache_path(folder, url):
+    """Returns the file a site's robots.txt is saved to in the folder
+
+    Each scheme and host (with its port) has its own file, so a copy
+    saved from one site is never used for another.
+    """
+    parts = urlsplit(url)
+    name = UNSAFE.sub("_", "%s_%s" % (parts.scheme, parts.netloc))
+
+    return os.path.join(str(folder), "robots", "%s.txt" % name)
+
+def read_robots(url, agent, cachePath, ttl):
+    """Returns a parser for the robots.txt file, using a saved copy
+
+    The file is only requested again once the saved copy is older than
+    ttl seconds. If the request fails, an older copy is used instead.
+    """
+    text = None
+    age = None
+
+    if os.path.exists(str(cachePath)):
+        age = time.time() - os.path.getmtime(str(cachePath))
+
+    if age is None or age >= ttl:
+        try:
+            text = fetch_robots(url, agent)
+        except Exception:
+            if age is None:
+                raise
+
+            log.exception("Unable to refresh robots.txt, using saved copy")
+        else:
+            os.makedirs(os.path.dirname(str(cachePath)), exist_ok=True)
+
+            with open(str(cachePath), "w") as file:
+                file.write(text)
+
+    if text is None:
+        log.debug("Using robots.txt saved %.0f s ago" % age)
+
+        with open(str(cachePath), "r") as file:
+            text = file.read()
+
+    robot = robotparser.RobotFileParser(url)
+    robot.parse(text.splitlines())
+
+    return robot
+
+def get_robots_delay(robot, agent):
+    """Returns the seconds between requests asked for by robots.txt
+
+    Uses the slower of Crawl-delay and Request-rate, or None if the
+    file gives neither.
+    """
+    delays = []
+    crawlDelay = robot.crawl_delay(agent)
+    requestRate = robot.request_rate(agent)
+
+    if crawlDelay is not None:
+        delays.append(float(crawlDelay))
+
+    if requestRate is not None and requestRate.requests:
+        delays.append(requestRate.seconds / requestRate.requests)
+
+    return max(delays) if delays else None
@@ -0,0 +1,195 @@
+from email.utils import parsedate_to_datetime
+import datetime
+import heapq
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class RequestScheduler(object):
+    """Spaces the start of each request by the robots.txt crawl-delay
+
+    Works as a token bucket holding a single token that refills every
+    crawl delay. The bucket starts empty, so even the first request
+    waits a full delay. Time spent on the request itself and on parsing
+    counts towards the next delay instead of being added on top of it.
+    One scheduler is shared by every crawl so the delay is honoured
+    for the whole run, not just within a single request loop.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.nextStart = time.monotonic() + delay
+
+    def wait(self):
+        """Blocks until the next request is allowed to start
+
+        Returns the seconds spent waiting.
+        """
+        # Reserve the next slot under the lock, but sleep outside of it
+        # so other threads can queue up behind this request
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.nextStart)
+            self.nextStart = start + self.delay
+
+        time.sleep(start - now)
+
+        return start - now
+
+    def next_start(self):
+        """Returns the monotonic time the next request could start"""
+        with self.lock:
+            return max(time.monotonic(), self.nextStart)
+
+    def pause(self, seconds):
+        """Holds back every request for at least the given seconds"""
+        with self.lock:
+            self.nextStart = max(self.nextStart, time.monotonic() + seconds)
+
+    def record(self, latency, error=False):
+        """Notes how long a request took and whether it failed"""
+        pass
+
+class AdaptiveScheduler(RequestScheduler):
+    """Request scheduler that slows down when the website struggles
+
+    Keeps moving averages of the response time and error rate. A failed
+    request doubles the delay and slow responses raise it by half, up
+    to maxDelay, starting from at least step seconds so it also slows
+    down with no minimum delay. The delay is held while the error rate
+    stays high, then falls back by a tenth per healthy request, but
+    never below the minimum delay from robots.txt.
+    """
+
+    def __init__(self, minDelay, maxDelay=120, slowResponse=5,
+                 errorLimit=0.1, smoothing=0.2, step=1):
+        super(AdaptiveScheduler, self).__init__(minDelay)
+        self.minDelay = minDelay
+        self.maxDelay = max(maxDelay, minDelay)
+        self.step = step
+        self.slowResponse = slowResponse
+        self.errorLimit = errorLimit
+        self.smoothing = smoothing
+        self.latency = None
+        self.errorRate = 0
+
+    def record(self, latency, error=False):
+        with self.lock:
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = (
+                    self.smoothing * latency
+                    + (1 - self.smoothing) * self.latency
+                )
+
+            self.errorRate = (
+                self.smoothing * (1 if error else 0)
+                + (1 - self.smoothing) * self.errorRate
+            )
+
+            previous = self.delay
+
+            if error:
+                delay = max(self.delay, self.step) * 2
+            elif self.latency > self.slowResponse:
+                delay = max(self.delay, self.step) * 1.5
+            elif self.errorRate > self.errorLimit:
+                delay = self.delay
+            else:
+                delay = self.delay * 0.9
+
+            self.delay = min(max(delay, self.minDelay), self.maxDelay)
+
+        if self.delay > previous * 1.25 + 0.5:
+            log.warning(
+                "Slowing to %.1f s between requests (%.1f s responses, "
+                "%.0f%% errors)"
+                % (self.delay, self.latency, self.errorRate * 100)
+            )
+
+class RetryQueue(object):
+    """Pages waiting to be requested again after a failed request
+
+    Each failure doubles the wait before the page is retried, starting
+    at the backoff time and never shorter than any Retry-After given
+    by the server. Pages that fail more than the allowed attempts are
+    kept in the failed list for the run summary.
+    """
+
+    def __init__(self, attempts, backoff):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.tries = {}
+        self.waiting = []
+        self.failed = []
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def push(self, page):
+        """Queues a page to be requested as soon as possible"""
+        heapq.heappush(self.waiting, (time.monotonic(), page))
+
+    def add(self, page, retryAfter=None):
+        """Queues a failed page for another attempt
+
+        Returns False if the page has no attempts left.
+        """
+        tries = self.tries.get(page, 0) + 1
+        self.tries[page] = tries
+
+        if tries > self.attempts:
+            log.error("Page %s failed after %s attempts" % (page, tries))
+            self.failed.append(page)
+
+            return False
+
+        delay = self.backoff * 2 ** (tries - 1)
+
+        if retryAfter:
+            delay = max(delay, retryAfter)
+
+        log.info("Retrying page %s in %s seconds" % (page, delay))
+        heapq.heappush(self.waiting, (time.monotonic() + delay, page))
+
+        return True
+
+    def due(self):
+        """Returns the next page ready to retry (None if not ready)"""
+        if self.waiting and self.waiting[0][0] <= time.monotonic():
+            return heapq.heappop(self.waiting)[1]
+
+        return None
+
+    def ready_at(self):
+        """Returns the monotonic time the next page is ready to retry"""
+        return self.waiting[0][0] if self.waiting else None
+
+    def wait(self):
+        """Blocks until the next queued page is ready to retry"""
+        if self.waiting:
+            time.sleep(max(self.waiting[0][0] - time.monotonic(), 0))
+
+def parse_retry_after(value):
+    """Converts a Retry-After header into seconds (None if invalid)"""
+    if not value:
+        return None
+
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        pass
+
+    # Otherwise the header is an HTTP date
+    try:
+        retryDate = parsedate_to_datetime(value)
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        return max((retryDate - now).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
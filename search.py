@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+
+"""Memory-mapped search index over the latest extracts
+
+    Each index file holds one day's pharmacist or pharmacy records with
+    a sorted name table and posting lists for the city, postal code
+    forward sortation area (first three characters) and the APA and
+    injection flags. The file is mapped rather than read, so opening it
+    is instant and a lookup only touches the pages it needs.
+
+    Usage: search.py build EXTRACTS_FOLDER [DATE]
+           search.py query INDEX --city Edmonton --apa
+           search.py query INDEX --name "smith, a" --fsa T5
+"""
+
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import islice
+import argparse
+import csv
+import heapq
+import html
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+
+from records import PharmacistData, PharmacyData, read_extract
+
+log = logging.getLogger(__name__)
+
+# Record types indexed, by the name used in the extract file names
+INDEXES = {
+    "Pharmacist": PharmacistData,
+    "Pharmacy": PharmacyData
+}
+
+# Sections of an index file, in the order they are written
+SECTIONS = (
+    "fields", "rows", "rowOffsets", "names", "nameOffsets", "nameRows",
+    "terms", "termOffsets", "postingOffsets", "postings"
+)
+
+# File signature, version, byte order and each section's offset and size
+MAGIC = b"RXSEARCH"
+VERSION = 1
+HEADER = struct.Struct("<8sII%sQ" % (len(SECTIONS) * 2))
+
+# Separates the values of a record in the rows section
+SEPARATOR = "\x1f"
+
+# Sorts after any character, to find the end of a prefix range
+HIGHEST = "\U0010ffff"
+
+# Offsets and row numbers are unsigned 32 bit integers
+assert array("I").itemsize == 4
+
+
+class StringTable(object):
+    """Strings stored back to back, found by their offsets
+
+    Supports len() and indexing, so bisect can search a sorted table
+    without decoding every string.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start = self.offsets[i]
+        end = self.offsets[i + 1]
+
+        return bytes(self.blob[start:end]).decode("UTF-8")
+
+def string_table(values):
+    """Returns the encoded strings and their offsets for a StringTable"""
+    offsets = array("I", [0])
+    parts = []
+    size = 0
+
+    for value in values:
+        data = value.encode("UTF-8")
+        parts.append(data)
+        size = size + len(data)
+        offsets.append(size)
+
+    return b"".join(parts), offsets
+
+def member_test(runs):
+    """Returns a function telling if a row is in the sorted runs
+
+    A single run is binary searched in place, while several runs (such
+    as every area starting with T5) are gathered into a set first.
+    """
+    if len(runs) != 1:
+        return set().union(*runs).__contains__
+
+    run = runs[0]
+
+    def contains(row):
+        i = bisect_left(run, row)
+
+        return i < len(run) and run[i] == row
+
+    return contains
+
+def index_key(text):
+    """Returns text as compared in the index: unescaped and lower case"""
+    return " ".join(html.unescape(str(text)).lower().split())
+
+def record_terms(r):
+    """Returns the city, area and flag terms a record is listed under"""
+    terms = []
+
+    if r.city:
+        terms.append("city:%s" % index_key(r.city))
+
+    if r.postal:
+        terms.append("fsa:%s" % index_key(r.postal).replace(" ", "")[:3])
+
+    for flag in ("apa", "inject"):
+        if int(getattr(r, flag, 0) or 0):
+            terms.append(flag)
+
+    return terms
+
+def build_index(path, record, records):
+    """Writes an index file for the records
+
+    The file is written next to the path and moved into place once it
+    is complete, so an open index is never overwritten part way.
+    Returns the number of records indexed.
+    """
+    rows = []
+    names = []
+    postings = {}
+
+    for i, r in enumerate(records):
+        rows.append(SEPARATOR.join(str(v) for v in r))
+        names.append((index_key(r[1]), i))
+
+        for term in record_terms(r):
+            postings.setdefault(term, []).append(i)
+
+    names.sort()
+    terms = sorted(postings)
+
+    postingOffsets = array("I", [0])
+    postingRows = array("I")
+
+    for term in terms:
+        postingRows.extend(postings[term])
+        postingOffsets.append(len(postingRows))
+
+    rowBlob, rowOffsets = string_table(rows)
+    nameBlob, nameOffsets = string_table(key for key, i in names)
+    termBlob, termOffsets = string_table(terms)
+
+    sections = (
+        SEPARATOR.join(record._fields).encode("UTF-8"),
+        rowBlob, rowOffsets.tobytes(),
+        nameBlob, nameOffsets.tobytes(),
+        array("I", (i for key, i in names)).tobytes(),
+        termBlob, termOffsets.tobytes(),
+        postingOffsets.tobytes(), postingRows.tobytes()
+    )
+
+    # Sections follow the header, each padded to 8 bytes
+    positions = []
+    position = HEADER.size
+
+    for data in sections:
+        positions.extend((position, len(data)))
+        position = position + len(data) + (-len(data) % 8)
+
+    tempPath = "%s.tmp" % path
+
+    with open(tempPath, "wb") as file:
+        file.write(HEADER.pack(
+            MAGIC, VERSION, sys.byteorder == "little", *positions
+        ))
+
+        for data in sections:
+            file.write(data)
+            file.write(b"\0" * (-len(data) % 8))
+
+    os.replace(tempPath, str(path))
+
+    return len(rows)
+
+class SearchIndex(object):
+    """Looks up records in an index file written by build_index
+
+    The file is memory-mapped and searched in place. Lookups return
+    records with every value as text, in the extract's field order.
+    Filters are combined, so only records matching all of them are
+    returned.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(str(path), "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, little, *positions = HEADER.unpack_from(self.map)
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("%s is not a version %s search index"
+                             % (path, VERSION))
+
+        if little != (sys.byteorder == "little"):
+            self.close()
+            raise ValueError("%s was built on a different platform" % path)
+
+        # Views are kept so they can be released before the map closes
+        self.views = []
+        section = {}
+
+        for i, name in enumerate(SECTIONS):
+            start, size = positions[i * 2:i * 2 + 2]
+            view = memoryview(self.map)[start:start + size]
+            self.views.append(view)
+
+            if name.endswith(("Offsets", "Rows")) or name == "postings":
+                view = view.cast("I")
+                self.views.append(view)
+
+            section[name] = view
+
+        fields = bytes(section["fields"]).decode("UTF-8").split(SEPARATOR)
+        self.record = namedtuple("SearchResult", fields)
+
+        self.rows = StringTable(section["rows"], section["rowOffsets"])
+        self.names = StringTable(section["names"], section["nameOffsets"])
+        self.nameRows = section["nameRows"]
+        self.terms = StringTable(section["terms"], section["termOffsets"])
+        self.postingOffsets = section["postingOffsets"]
+        self.postings = section["postings"]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def close(self):
+        for view in reversed(getattr(self, "views", [])):
+            view.release()
+
+        self.map.close()
+        self.file.close()
+
+    def row(self, i):
+        """Returns record number i"""
+        return self.record(*self.rows[i].split(SEPARATOR))
+
+    def prefix_range(self, table, prefix):
+        """Returns the first and last + 1 positions starting with prefix"""
+        return (
+            bisect_left(table, prefix), bisect_left(table, prefix + HIGHEST)
+        )
+
+    def name_rows(self, prefix):
+        """Returns the rows whose name starts with prefix, in order"""
+        start, end = self.prefix_range(self.names, index_key(prefix))
+
+        return [sorted(self.nameRows[start:end])]
+
+    def term_rows(self, term, prefix=False):
+        """Returns the rows listed under a term (or any term it starts)
+
+        Rows are returned as one sorted run per term, read in place
+        from the mapped file.
+        """
+        if prefix:
+            start, end = self.prefix_range(self.terms, term)
+        else:
+            start = bisect_left(self.terms, term)
+            end = start + 1
+
+            if start >= len(self.terms) or self.terms[start] != term:
+                return []
+
+        return [
+            self.postings[self.postingOffsets[i]:self.postingOffsets[i + 1]]
+            for i in range(start, end)
+        ]
+
+    def search(self, name=None, city=None, fsa=None, apa=False,
+               inject=False, limit=None):
+        """Returns the records matching every filter given
+
+        name matches the start of the pharmacist or pharmacy name and
+        fsa the start of the postal code (so "T5" finds T5A to T5Z).
+        City and name are not case sensitive. Records are returned in
+        extract order, up to limit records.
+
+        The rows of the most selective filter are walked in order and
+        looked up in the others, stopping once limit records are found.
+        """
+        matches = []
+
+        if name:
+            matches.append(self.name_rows(name))
+
+        if city:
+            matches.append(self.term_rows("city:%s" % index_key(city)))
+
+        if fsa:
+            matches.append(self.term_rows(
+                "fsa:%s" % index_key(fsa).replace(" ", "")[:3], prefix=True
+            ))
+
+        for flag, wanted in (("apa", apa), ("inject", inject)):
+            if wanted:
+                matches.append(self.term_rows(flag))
+
+        if matches:
+            matches.sort(key=lambda runs: sum(len(run) for run in runs))
+            tests = [member_test(runs) for runs in matches[1:]]
+
+            rows = (
+                i for i in heapq.merge(*matches[0])
+                if all(test(i) for test in tests)
+            )
+        else:
+            rows = range(len(self))
+
+        return [self.row(i) for i in islice(rows, limit)]
+
+def latest_extract_date(folder):
+    """Returns the date of the newest pharmacist extract in the folder"""
+    suffix = " - Pharmacist.csv"
+    dates = [
+        f[:-len(suffix)] for f in os.listdir(str(folder))
+        if f.endswith(suffix)
+    ]
+
+    return max(dates) if dates else None
+
+def build_indexes(folder, date=None):
+    """Builds Pharmacist.index and Pharmacy.index from a day's extracts
+
+    Uses the latest extracts in the folder if no date is given.
+    """
+    date = date or latest_extract_date(folder)
+
+    if date is None:
+        log.warning("No extracts found in %s to index" % folder)
+        return
+
+    for name, record in INDEXES.items():
+        path = os.path.join(str(folder), "%s - %s.csv" % (date, name))
+
+        if not os.path.exists(path):
+            log.warning("No extract found at %s" % path)
+            continue
+
+        start = time.perf_counter()
+        count = build_index(
+            os.path.join(str(folder), "%s.index" % name), record,
+            (r for chunk in read_extract(path, record, date) for r in chunk)
+        )
+
+        log.info(
+            "Indexed %s %s %s records in %.1f s"
+            % (count, date, name.lower(), time.perf_counter() - start)
+        )
+
+def get_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Search the extracts")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    buildParser = commands.add_parser(
+        "build", help="index the latest (or a given day's) extracts"
+    )
+    buildParser.add_argument("folder")
+    buildParser.add_argument("date", nargs="?")
+
+    queryParser = commands.add_parser(
+        "query", help="print the matching records as CSV"
+    )
+    queryParser.add_argument("index", help="Pharmacist or Pharmacy.index")
+    queryParser.add_argument("--name", help="start of the name")
+    queryParser.add_argument("--city")
+    queryParser.add_argument("--fsa", help="start of the postal code")
+    queryParser.add_argument("--apa", action="store_true")
+    queryParser.add_argument("--inject", action="store_true")
+    queryParser.add_argument("--limit", type=int)
+
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    args = get_arguments()
+
+    if args.command == "build":
+        build_indexes(args.folder, args.date)
+    else:
+        index = SearchIndex(args.index)
+
+        start = time.perf_counter()
+        records = index.search(
+            args.name, args.city, args.fsa, args.apa, args.inject,
+            args.limit
+        )
+        elapsed = time.perf_counter() - start
+
+        writer = csv.writer(sys.stdout, lineterminator="\n")
+        writer.writerow(index.record._fields)
+        writer.writerows(records)
+
+        log.info("%s records in %.0f us" % (len(records), elapsed * 1e6))
+
+        index.close()
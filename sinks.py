@@ -0,0 +1,392 @@
+import csv
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Columns indexed for lookups (where the table has them)
+INDEXED_FIELDS = ("pharmacist", "pharmacy", "city", "postal")
+
+
+class QualityError(ValueError):
+    """Raised to stop an upload when the extract fails validation"""
+    pass
+
+class Sink(object):
+    """Destination that receives parsed records one page at a time"""
+    name = "sink"
+
+    def open(self):
+        """Prepares the sink to receive records"""
+        pass
+
+    def write(self, records):
+        """Saves a page of records"""
+        raise NotImplementedError
+
+    def close(self):
+        """Finalizes any remaining output"""
+        pass
+
+class CSVSink(Sink):
+    """Writes records to a quoted CSV file as they arrive
+
+    Records are written in field order without the leading date.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = path
+        self.file = None
+        self.writer = None
+
+    def open(self):
+        self.file = open(self.path, "w")
+        self.writer = self.create_writer(self.file)
+
+    def create_writer(self, file):
+        """Returns the quoted CSV writer used for the file"""
+        return csv.writer(
+            file,
+            delimiter=",",
+            quotechar='"',
+            lineterminator="\n",
+            quoting=csv.QUOTE_ALL
+        )
+
+    def write(self, records):
+        self.writer.writerows(r[1:] for r in records)
+
+        # Flush each page so a crash keeps everything already fetched
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+        log.info("Data written to %s" % self.path)
+
+class StagingTables(object):
+    """Staging and latest snapshot tables for one uploaded table
+
+    Rows are loaded into <table>_staging first. Once the staged count 
+    matches the records parsed, the day's rows are swapped into the 
+    table in one transaction, so a failed or repeated upload never 
+    leaves a partial or doubled day. <table>_latest keeps a copy of 
+    the newest day, indexed for lookups. Both tables are created from 
+    the table's columns if they do not exist. If a check is given, it 
+    is called before the swap and can raise an error to stop it.
+    """
+
+    def __init__(self, conn, table, fields, placeholder="%s", check=None):
+        self.conn = conn
+        self.table = table
+        self.columns = fields
+        self.placeholder = placeholder
+        self.check = check
+        self.staging = "%s_staging" % table
+        self.latest = "%s_latest" % table
+
+    def create(self):
+        """Creates the staging and latest tables if they are missing"""
+        self.create_table(self.staging, ("date",))
+        self.create_table(
+            self.latest, [f for f in INDEXED_FIELDS if f in self.columns]
+        )
+
+    def create_table(self, name, indexes):
+        """Creates an empty copy of the table columns with indexes"""
+        cursor = self.conn.cursor()
+
+        # Checked by querying, as MySQL has no CREATE INDEX IF NOT EXISTS
+        try:
+            cursor.execute("SELECT 1 FROM %s WHERE 1 = 0" % name)
+            cursor.fetchall()
+            return
+        except Exception:
+            self.conn.rollback()
+
+        cursor.execute(
+            "CREATE TABLE %s AS SELECT %s FROM %s WHERE 1 = 0"
+            % (name, ", ".join(self.columns), self.table)
+        )
+
+        for field in indexes:
+            cursor.execute(
+                "CREATE INDEX %s_%s ON %s (%s)" % (name, field, name, field)
+            )
+
+        self.conn.commit()
+
+        log.info("Created %s" % name)
+
+    def swap(self, date, expected):
+        """Replaces the rows for date with the staged rows
+
+        Raises an error, leaving the table unchanged, if the number of 
+        staged rows differs from the expected count or the check fails.
+        The latest table is only replaced if no newer date has been 
+        uploaded.
+        """
+        cursor = self.conn.cursor()
+        where = " WHERE date = %s" % self.placeholder
+        columns = ", ".join(self.columns)
+
+        try:
+            cursor.execute(
+                "SELECT COUNT(*) FROM %s%s" % (self.staging, where), (date,)
+            )
+            count = cursor.fetchone()[0]
+
+            if count != expected:
+                raise ValueError(
+                    "%s has %s rows for %s but %s records were parsed" 
+                    % (self.staging, count, date, expected)
+                )
+
+            if self.check:
+                self.check()
+
+            cursor.execute("DELETE FROM %s%s" % (self.table, where), (date,))
+            cursor.execute(
+                "INSERT INTO %s (%s) SELECT %s FROM %s%s" 
+                % (self.table, columns, columns, self.staging, where),
+                (date,)
+            )
+
+            cursor.execute(
+                "SELECT COUNT(*) FROM %s WHERE date > %s" 
+                % (self.latest, self.placeholder),
+                (date,)
+            )
+
+            if not cursor.fetchone()[0]:
+                cursor.execute("DELETE FROM %s" % self.latest)
+                cursor.execute(
+                    "INSERT INTO %s (%s) SELECT %s FROM %s%s" 
+                    % (self.latest, columns, columns, self.staging, where),
+                    (date,)
+                )
+
+            cursor.execute(
+                "DELETE FROM %s%s" % (self.staging, where), (date,)
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        return count
+
+class DatabaseSink(Sink):
+    """Inserts records into a database table in chunked transactions
+
+    The record fields are used as the table columns, in the same order.
+    Rows already saved for the run date are deleted when the sink opens 
+    so a resumed run does not upload them twice. Each chunk is committed
+    on its own and rolled back if it fails. With staging, the chunks go 
+    to the staging table and are swapped in when the sink closes.
+    """
+
+    def __init__(self, conn, table, fields, date, chunkSize=1000, 
+                 placeholder="%s", staging=None):
+        self.conn = conn
+        self.table = table
+        self.columns = fields
+        self.date = date
+        self.chunkSize = chunkSize
+        self.placeholder = placeholder
+        self.staging = staging
+        self.name = table
+        self.cursor = None
+        self.batch = []
+        self.count = 0
+        self.elapsed = 0
+
+        self.target = staging.staging if staging else table
+        self.query = "INSERT INTO %s (%s) VALUES (%s)" % (
+            self.target,
+            ", ".join(self.columns),
+            ", ".join([placeholder] * len(self.columns))
+        )
+
+    def open(self):
+        if self.staging:
+            self.staging.create()
+
+        self.cursor = self.conn.cursor()
+        self.transaction(
+            "DELETE FROM %s WHERE date = %s" 
+            % (self.target, self.placeholder),
+            (self.date,)
+        )
+
+    def transaction(self, query, args, many=False):
+        """Runs a query and commits it, rolling back on failure"""
+        start = time.perf_counter()
+
+        try:
+            if many:
+                self.cursor.executemany(query, args)
+            else:
+                self.cursor.execute(query, args)
+
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.elapsed = self.elapsed + time.perf_counter() - start
+
+    def write(self, records):
+        self.batch.extend(records)
+
+        while len(self.batch) >= self.chunkSize:
+            self.flush(self.chunkSize)
+
+    def flush(self, size=None):
+        """Inserts the next chunk of batched records"""
+        chunk = self.batch[:size] if size else self.batch
+
+        if chunk:
+            self.transaction(self.query, chunk, many=True)
+            self.count = self.count + len(chunk)
+            self.batch = self.batch[len(chunk):]
+
+    def close(self):
+        self.flush()
+
+        if self.staging:
+            start = time.perf_counter()
+            self.staging.swap(self.date, self.count)
+            self.elapsed = self.elapsed + time.perf_counter() - start
+
+        report_upload(self.table, self.count, self.elapsed)
+
+class LoadDataSink(Sink):
+    """Loads a finished CSV file with MySQL LOAD DATA LOCAL INFILE
+
+    Records are not sent as they arrive; instead the CSV file is loaded
+    in one statement when the sink closes, so this sink must come after
+    the CSVSink writing that file. The connection needs local_infile 
+    enabled and the CSV file must be UTF-8. With staging, the file is 
+    loaded into the staging table and swapped in once the row count 
+    matches the records written.
+    """
+
+    def __init__(self, conn, table, fields, date, path, staging=None):
+        self.conn = conn
+        self.table = table
+        self.columns = fields
+        self.date = date
+        self.path = path
+        self.staging = staging
+        self.name = table
+        self.count = 0
+
+        self.target = staging.staging if staging else table
+
+    def open(self):
+        if self.staging:
+            self.staging.create()
+
+    def write(self, records):
+        self.count = self.count + len(records)
+
+    def close(self):
+        start = time.perf_counter()
+        cursor = self.conn.cursor()
+
+        # The CSV files leave out the date, which is set for every row
+        query = (
+            "LOAD DATA LOCAL INFILE %%s INTO TABLE %s CHARACTER SET utf8 "
+            "FIELDS TERMINATED BY ',' ENCLOSED BY '\"' ESCAPED BY '' "
+            "LINES TERMINATED BY '\\n' (%s) SET date = %%s"
+        ) % (self.target, ", ".join(self.columns[1:]))
+
+        # Replace any rows already loaded for the date in one transaction
+        try:
+            cursor.execute(
+                "DELETE FROM %s WHERE date = %%s" % self.target, (self.date,)
+            )
+            count = cursor.execute(query, (str(self.path), self.date))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        if self.staging:
+            count = self.staging.swap(self.date, self.count)
+
+        report_upload(self.table, count, time.perf_counter() - start)
+
+def report_upload(table, count, elapsed):
+    """Logs the number of rows uploaded and the upload rate"""
+    rate = count / elapsed if elapsed else 0
+
+    log.info(
+        "Uploaded %s records to %s in %.1f s (%.0f rows/sec)" 
+        % (count, table, elapsed, rate)
+    )
+
+class Pipeline(object):
+    """Sends each page of records to every sink
+
+    A sink that raises an error is logged and dropped, so one failing
+    destination does not stop the others from receiving data. The rows
+    and time spent in each sink are kept in timings, and the sinks 
+    whose upload was stopped by a QualityError in blocked.
+    """
+
+    def __init__(self, sinks):
+        self.sinks = []
+        self.timings = {}
+        self.blocked = []
+
+        for sink in sinks:
+            start = time.perf_counter()
+
+            try:
+                sink.open()
+                self.sinks.append(sink)
+            except Exception:
+                log.exception("Unable to open %s" % sink.name)
+
+            self.add_timing(sink, 0, start)
+
+    def add_timing(self, sink, rows, start):
+        """Adds rows and the time since start to the sink timings"""
+        timing = self.timings.setdefault(str(sink.name), [0, 0])
+        timing[0] = timing[0] + rows
+        timing[1] = timing[1] + time.perf_counter() - start
+
+    def write(self, records):
+        for sink in list(self.sinks):
+            start = time.perf_counter()
+            rows = 0
+
+            try:
+                sink.write(records)
+                rows = len(records)
+            except Exception:
+                log.exception("Error writing to %s" % sink.name)
+                self.sinks.remove(sink)
+
+            self.add_timing(sink, rows, start)
+
+    def close(self):
+        for sink in self.sinks:
+            start = time.perf_counter()
+
+            try:
+                sink.close()
+            except QualityError as e:
+                log.error("Upload to %s blocked: %s" % (sink.name, e))
+                self.blocked.append(sink.name)
+            except Exception:
+                log.exception("Error closing %s" % sink.name)
+
+            self.add_timing(sink, 0, start)
+
+        self.sinks = []
@@ -0,0 +1,214 @@
+import html
+import json
+import logging
+
+from locations import POSTAL_CODE, NON_DIGITS
+from sinks import Sink, CSVSink, QualityError
+
+log = logging.getLogger(__name__)
+
+# Fields whose text is unescaped and has its spacing collapsed
+TEXT_FIELDS = (
+    "pharmacist", "pharmacy", "manager", "address", "city", "restrictions"
+)
+
+# Fields that must be filled in whenever the address is
+LOCATION_FIELDS = ("city", "postal")
+
+# Ten digit phone and fax numbers
+PHONE_FIELDS = ("phone", "fax")
+
+# Fields that hold 0 or 1
+FLAG_FIELDS = ("apa", "inject")
+
+# Invalid values kept in the report for each field
+EXAMPLES = 3
+
+
+def normalize_text(column):
+    """Returns the text unescaped, with single spaces between words"""
+    return [" ".join(html.unescape(str(v)).split()) for v in column]
+
+def normalize_postal(column):
+    """Returns postal codes in upper case with one space"""
+    postal = ["".join(str(v).upper().split()) for v in column]
+
+    return ["%s %s" % (v[:3], v[3:]) if len(v) == 6 else v for v in postal]
+
+def normalize_phone(column):
+    """Returns only the ten digits of each number"""
+    digits = [NON_DIGITS.sub("", str(v)) for v in column]
+
+    return [v[1:] if len(v) == 11 and v[0] == "1" else v for v in digits]
+
+def normalize_flag(column):
+    """Returns 0 and 1 flags as integers"""
+    return [int(v) if str(v) in ("0", "1") else v for v in column]
+
+def normalize_columns(fields, columns):
+    """Returns a cleaned copy of each column
+
+    Text is unescaped with single spaces, postal codes are upper case
+    with one space, phone and fax numbers are only their ten digits and
+    flags are integers. Values that cannot be cleaned are kept as is.
+    """
+    normalized = {}
+
+    for field in fields:
+        column = columns[field]
+
+        if field in TEXT_FIELDS:
+            column = normalize_text(column)
+        elif field == "postal":
+            column = normalize_postal(column)
+        elif field in PHONE_FIELDS:
+            column = normalize_phone(column)
+        elif field in FLAG_FIELDS:
+            column = normalize_flag(column)
+
+        normalized[field] = column
+
+    return normalized
+
+def invalid_rows(field, columns, normalized, registrations):
+    """Returns a list of True for every row with an invalid value
+
+    Checks the normalized column, so a value is only invalid if
+    cleaning it up does not fix it. Blank values are only invalid for
+    the city and postal code of a record that has an address, which is
+    how a failed address split shows up.
+    """
+    column = normalized[field]
+
+    if field in LOCATION_FIELDS and "address" in columns:
+        missing = [
+            bool(a) and not v for a, v in zip(columns["address"], column)
+        ]
+    else:
+        missing = [False] * len(column)
+
+    if field == "postal":
+        return [
+            m or (bool(v) and not POSTAL_CODE.fullmatch(v))
+            for m, v in zip(missing, column)
+        ]
+    elif field in PHONE_FIELDS:
+        return [bool(v) and len(v) != 10 for v in column]
+    elif field in FLAG_FIELDS:
+        return [v not in (0, 1) for v in column]
+    elif field == "registration" and registrations:
+        return [v not in registrations for v in column]
+
+    return missing
+
+def quality_report(fields, columns, normalized, registrations=()):
+    """Returns the empty and invalid counts and quality of each field
+
+    Quality is the fraction of rows with a valid value. A few of the
+    invalid values are kept as examples.
+    """
+    report = {}
+
+    for field in fields[1:]:
+        column = columns[field]
+        invalid = invalid_rows(field, columns, normalized, registrations)
+        count = sum(invalid)
+
+        report[field] = {
+            "empty": sum(1 for v in column if v in ("", None)),
+            "invalid": count,
+            "quality": 1 - count / len(column) if column else 1,
+            "examples": sorted(set(
+                str(v) for v, bad in zip(column, invalid) if bad
+            ))[:EXAMPLES]
+        }
+
+    return report
+
+class ValidationSink(Sink):
+    """Checks every column of an extract once all records have arrived
+
+    Values are collected column by column, then validated and cleaned
+    a column at a time when the sink closes. The per field report is
+    logged and saved as JSON, and the cleaned records can be saved to
+    a Normalized CSV. Uploads given this sink's check (see
+    StagingTables) are refused when any field's quality is below the
+    threshold, so this sink must come before them.
+    """
+
+    def __init__(self, record, date, reportPath, threshold=0,
+                 registrations=(), normalizedPath=None):
+        self.record = record
+        self.date = date
+        self.reportPath = reportPath
+        self.threshold = threshold
+        self.registrations = registrations
+        self.normalizedPath = normalizedPath
+        self.name = "%s validation" % record.__name__
+        self.columns = None
+        self.report = None
+
+    def open(self):
+        self.columns = [[] for field in self.record._fields]
+
+    def write(self, records):
+        for column, values in zip(self.columns, zip(*records)):
+            column.extend(values)
+
+    def close(self):
+        fields = self.record._fields
+        columns = dict(zip(fields, self.columns))
+        normalized = normalize_columns(fields, columns)
+        report = quality_report(
+            fields, columns, normalized, self.registrations
+        )
+
+        failed = sorted(
+            field for field, result in report.items()
+            if result["quality"] < self.threshold
+        )
+
+        for field in fields[1:]:
+            result = report[field]
+
+            if result["invalid"]:
+                log.warning(
+                    "%s %s: %s invalid of %s (%.1f%% valid, e.g. %s)"
+                    % (self.record.__name__, field, result["invalid"],
+                       len(columns[field]), result["quality"] * 100,
+                       ", ".join(result["examples"]))
+                )
+
+        self.report = {
+            "date": self.date,
+            "records": len(self.columns[0]),
+            "threshold": self.threshold,
+            "failed": failed,
+            "fields": report
+        }
+
+        with open(str(self.reportPath), "w") as file:
+            json.dump(self.report, file, indent=4)
+
+        if self.normalizedPath:
+            sink = CSVSink(self.normalizedPath)
+            sink.open()
+            sink.write(zip(*(normalized[field] for field in fields)))
+            sink.close()
+
+        self.columns = None
+
+        log.info("Quality report written to %s" % self.reportPath)
+
+    def check(self):
+        """Raises a QualityError unless the extract passed validation"""
+        if self.report is None:
+            raise QualityError("%s did not finish" % self.name)
+
+        if self.report["failed"]:
+            raise QualityError(
+                "%s quality below %s for %s (see %s)" % (
+                    self.record.__name__, self.threshold,
+                    ", ".join(self.report["failed"]), self.reportPath
+                )
+            )